@@ -0,0 +1,515 @@
+# Neon Ride micro-benchmarks
+# Run from the repository root, e.g.: python3 benchmark.py grid
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+# Benchmarks never open a real window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import random
+import pygame
+import nrlevels
+import nrutil
+import nrrender
+import scratch_pen
+from scratch_pen import *
+from nrlevels import *
+from nrconstants import *
+
+# Camera offsets sampled along levels 1 and 2: (level, x, y, move)
+SAMPLE_POSITIONS = [
+    (1, 0, 0, 0),
+    (1, -300, 0, 0),
+    (1, -650, 140, 0),
+    (1, -900, -60, 0),
+    (1, -1200, -500, 0),
+    (1, 300, -1100, 0),
+    (2, 0, 0, 0),
+    (2, -600, 0, 40),
+    (2, -1100, -300, 80),
+    (2, -1650, -600, 120),
+    (2, -2050, -640, 160),
+]
+
+# Camera offsets where the character rests on the ground in play, so that
+# its strokes overlap the level's
+RESTING_POSITIONS = [
+    (1, 2, -2, 0),
+    (1, -482, 87, 0),
+    (1, -718, 127, 0),
+    (2, 10, 2, 100),
+    (2, -12, 3, 200),
+]
+
+# Pen positions probed around the character for each sample
+PROBE_OFFSETS = [(px + 0.37, py - 0.61) for px in range(-30, 31, 6) for py in range(-30, 31, 6)]
+
+
+def _time_per_call(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def _list_grid_touching(rows, x, y, color_id, hitbox_dimensions):
+    # The original list-of-lists query, kept here as the reference point
+    hitbox_width, hitbox_height = hitbox_dimensions
+    left = int(x - hitbox_width // 2)
+    right = int(x + math.ceil(hitbox_width / 2))
+    top = int(y - hitbox_height // 2)
+    bottom = int(y + math.ceil(hitbox_height / 2))
+    for sx in range(left, right):
+        for sy in range(top, bottom):
+            gx, gy = scratch_to_grid(sx, sy)
+            if gx is None:
+                continue
+            if rows[gy][gx] == color_id:
+                return True
+    return False
+
+
+def bench_grid(args):
+    """Compare grid engines on level rasterization and touching_color."""
+    pen = ScratchPen(pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT)))
+    # Repeated probes would otherwise be answered from the touching_color memo
+    scratch_pen.TOUCH_MEMO = False
+    print(f"{'engine':<10}{'draw ms/frame':>16}{'touching us':>14}{'speedup':>10}"
+          f"{'table ms':>10}{'table us':>10}")
+
+    # The list-of-lists baseline, fed from a pure-Python rasterization
+    scratch_pen.select_grid_engine("python")
+    cells = []
+    for level_number, x, y, move in SAMPLE_POSITIONS:
+        pen.erase_all()
+        load_level(level_number, x, y, pen, move)
+        flat = scratch_pen.color_grid.to_bytes()
+        cells.append([list(flat[row * COLOR_GRID_WIDTH:(row + 1) * COLOR_GRID_WIDTH])
+                      for row in range(COLOR_GRID_HEIGHT)])
+
+    def list_queries():
+        for rows in cells:
+            for px, py in PROBE_OFFSETS:
+                _list_grid_touching(rows, px, py, COLOR_ID_LEVEL, HITBOX_HORIZONTAL)
+
+    query_count = len(SAMPLE_POSITIONS) * len(PROBE_OFFSETS)
+    reference = _time_per_call(list_queries, args.repeat) / query_count
+    print(f"{'list':<10}{'-':>16}{reference * 1e6:>14.2f}{1.0:>10.1f}")
+
+    for engine in ("python", "bitset", "numpy"):
+        if engine == "numpy" and scratch_pen.numpy is None:
+            print(f"{engine:<10}{'(not installed)':>16}")
+            continue
+        scratch_pen.select_grid_engine(engine)
+
+        def draw_frames():
+            for level_number, x, y, move in SAMPLE_POSITIONS:
+                pen.erase_all()
+                load_level(level_number, x, y, pen, move)
+
+        draw_time = _time_per_call(draw_frames, args.repeat) / len(SAMPLE_POSITIONS)
+
+        # Queries scan the grid unless a summed-area table has been built:
+        # table ms is what building one costs, table us a query that uses it
+        grid = scratch_pen.color_grid
+        tables = engine in GRID_AREA_TABLE_QUERIES
+        query_time = table_time = build_time = 0
+        for level_number, x, y, move in SAMPLE_POSITIONS:
+            pen.erase_all()
+            load_level(level_number, x, y, pen, move)
+
+            def queries():
+                for pen.x, pen.y in PROBE_OFFSETS:
+                    pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL)
+
+            query_time += _time_per_call(queries, args.repeat)
+            if tables:
+                build_time += _time_per_call(lambda: grid._build_area(COLOR_ID_LEVEL), args.repeat)
+                grid.table_queries = 1
+                queries()
+                table_time += _time_per_call(queries, args.repeat)
+                grid.table_queries = GRID_AREA_TABLE_QUERIES[engine]
+        query_time /= query_count
+        row = f"{engine:<10}{draw_time * 1e3:>16.2f}{query_time * 1e6:>14.2f}{reference / query_time:>10.1f}"
+        if tables:
+            row += f"{build_time / len(SAMPLE_POSITIONS) * 1e3:>10.2f}{table_time / query_count * 1e6:>10.2f}"
+        print(row)
+    scratch_pen.TOUCH_MEMO = TOUCH_MEMO
+
+
+def _hitbox_rect(x, y, hitbox_dimensions, grow=0):
+    hitbox_width, hitbox_height = hitbox_dimensions
+    left = int(x - hitbox_width // 2) - grow
+    right = int(x + math.ceil(hitbox_width / 2)) + grow
+    top = int(y - hitbox_height // 2) - grow
+    bottom = int(y + math.ceil(hitbox_height / 2)) + grow
+    return left, right, top, bottom
+
+
+def _draw_character(pen, xvel=0):
+    # The strokes main.draw_character_with_sensing draws, without the sensing
+    pen.point_in_direction(112)
+    pen.set_pen_size(3)
+    pen.set_pen_color(CHARACTER_COLOR)
+    pen.pen_up()
+    pen.goto(0, 15)
+    pen.pen_down()
+    for _ in range(8):
+        pen.move(8)
+        pen.turn_right(45)
+    pen.pen_up()
+    for eye_x in (-0.2 * xvel - 3, -0.2 * xvel + 3):
+        pen.goto(eye_x, 10)
+        pen.pen_down()
+        pen.change_y_by(-5)
+        pen.pen_up()
+
+
+def _draw_debug_grid(pen, x, y, grid_size=10):
+    # The lines main.draw_grid draws, at the finer of its two sizes
+    pen.set_pen_size(1)
+    pen.set_pen_color("#656565")
+    pen.pen_up()
+    for i in range((480 // grid_size) + 2):
+        pen.goto(-240 + (x % grid_size) + i * grid_size, -180)
+        pen.pen_down()
+        pen.goto(-240 + (x % grid_size) + i * grid_size, 180)
+        pen.pen_up()
+    for i in range((360 // grid_size) + 2):
+        pen.goto(-240, -180 + (y % grid_size) + i * grid_size)
+        pen.pen_down()
+        pen.goto(240, -180 + (y % grid_size) + i * grid_size)
+        pen.pen_up()
+
+
+def _draw_frame(pen, level_number, x, y, move, debug_grid=False):
+    # The collision-relevant part of a game frame: the debug grid when it is
+    # on, the level, then the character over it
+    pen.erase_all()
+    if debug_grid:
+        _draw_debug_grid(pen, x, y)
+    load_level(level_number, x, y, pen, move)
+    _draw_character(pen)
+
+
+def check_collision(args):
+    """
+    Differential check of the analytic and sdf collision backends against the raster grid,
+    on frames drawn as the game draws them: the level with the character over it,
+    and at the resting positions also with the debug grid under the level.
+    """
+    pen = ScratchPen(pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT)))
+    probes = [(px + 0.37, py - 0.61) for px in range(-60, 61, 2) for py in range(-60, 61, 2)]
+    exact = near = mismatched = sdf_mismatched = 0
+    raster_time = analytic_time = sdf_time = 0
+    # No NumPy means no distance field; "sdf" is then the analytic backend again
+    sdf_world = scratch_pen.make_collision_backend("sdf")
+    frames = [(position, False) for position in SAMPLE_POSITIONS + RESTING_POSITIONS]
+    frames += [(position, True) for position in RESTING_POSITIONS]
+    for (level_number, x, y, move), debug_grid in frames:
+        scratch_pen.select_collision_backend("raster")
+        _draw_frame(pen, level_number, x, y, move, debug_grid)
+        grid = scratch_pen.color_grid
+        scratch_pen.select_collision_backend("analytic")
+        _draw_frame(pen, level_number, x, y, move, debug_grid)
+        world = scratch_pen.capsule_world
+        if sdf_world is not world:
+            scratch_pen.select_collision_backend("sdf")
+            _draw_frame(pen, level_number, x, y, move, debug_grid)
+        for px, py in probes:
+            for color_id in (COLOR_ID_LEVEL, COLOR_ID_GOAL):
+                for hitbox in (HITBOX_ROUND, HITBOX_VERTICAL, HITBOX_HORIZONTAL):
+                    rect = _hitbox_rect(px, py, hitbox)
+                    start = time.perf_counter()
+                    raster = grid.hitbox_touches(*rect, color_id)
+                    raster_time += time.perf_counter() - start
+                    start = time.perf_counter()
+                    analytic = world.hitbox_touches(*rect, color_id)
+                    analytic_time += time.perf_counter() - start
+                    start = time.perf_counter()
+                    sdf = sdf_world.hitbox_touches(*rect, color_id)
+                    sdf_time += time.perf_counter() - start
+                    # The distance field only settles queries early; answers
+                    # must match the analytic backend exactly
+                    if sdf != analytic:
+                        sdf_mismatched += 1
+                        print(f"SDF MISMATCH level {level_number} at ({x}, {y}) probe ({px}, {py}) "
+                              f"color {color_id} hitbox {hitbox}: analytic {analytic}, sdf {sdf}")
+                    if analytic == raster:
+                        exact += 1
+                    # Within one Scratch unit: the raster agrees once the
+                    # hitbox is grown (or shrunk) by one unit on every side
+                    elif analytic and grid.hitbox_touches(*_hitbox_rect(px, py, hitbox, 1), color_id) \
+                            or not analytic and not grid.hitbox_touches(*_hitbox_rect(px, py, hitbox, -1), color_id):
+                        near += 1
+                    else:
+                        mismatched += 1
+                        print(f"MISMATCH level {level_number} at ({x}, {y}) probe ({px}, {py}) "
+                              f"color {color_id} hitbox {hitbox}: raster {raster}, analytic {analytic}")
+    scratch_pen.select_collision_backend(COLLISION_BACKEND)
+    total = exact + near + mismatched
+    print(f"{total} queries: {exact} exact, {near} within one unit, {mismatched} mismatched, "
+          f"{sdf_mismatched} sdf mismatched")
+    print(f"raster {raster_time / total * 1e6:.2f} us/query, analytic {analytic_time / total * 1e6:.2f} us/query, "
+          f"sdf {sdf_time / total * 1e6:.2f} us/query")
+    if sdf_world is not scratch_pen.capsule_world:
+        print(f"sdf: {sdf_world.field_hits} settled by the field, {sdf_world.field_misses} by capsule tests")
+    if mismatched or sdf_mismatched:
+        sys.exit(1)
+
+
+def _camera_path():
+    # A level 1 run: idle, whole-pixel scrolling, sub-pixel drift, a respawn
+    path = [(0, 0)] * 20
+    x = y = 0
+    for _ in range(60):
+        x -= 1.5
+        path.append((x, y))
+    for _ in range(30):
+        y += 0.5
+        path.append((x, y))
+    for _ in range(30):
+        x -= 0.3
+        path.append((x, y))
+    path.append((-650, 140))
+    x, y = -650, 140
+    for _ in range(60):
+        x -= 2
+        y -= 1
+        path.append((x, y))
+    return path
+
+
+def bench_scroll(args):
+    """Replay a camera path with the scrolling level layer against full redraws."""
+    surfaces = {mode: pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT)) for mode in ("direct", "scroll")}
+    pens = {mode: ScratchPen(surface) for mode, surface in surfaces.items()}
+    path = _camera_path()
+    times = {"direct": 0, "scroll": 0}
+    mismatched = 0
+    # Analytic collision keeps grid rasterization out of the render timings
+    scratch_pen.select_collision_backend("analytic")
+    level_scroll_layer.invalidate()
+    for x, y in path:
+        for mode, pen in pens.items():
+            nrlevels.LEVEL_RENDER_MODE = mode
+            start = time.perf_counter()
+            pen.erase_all()
+            load_level(1, x, y, pen, 0)
+            times[mode] += time.perf_counter() - start
+        if pygame.image.tobytes(surfaces["direct"], "RGB") != pygame.image.tobytes(surfaces["scroll"], "RGB"):
+            mismatched += 1
+            print(f"MISMATCH at ({x}, {y})")
+    nrlevels.LEVEL_RENDER_MODE = LEVEL_RENDER_MODE
+    scratch_pen.select_collision_backend(COLLISION_BACKEND)
+    layer = level_scroll_layer
+    print(f"{len(path)} frames: {layer.reuses} reused, {layer.scrolls} scrolled, "
+          f"{layer.full_redraws} redrawn, {mismatched} mismatched")
+    print(f"direct {times['direct'] / len(path) * 1e3:.2f} ms/frame, "
+          f"scroll {times['scroll'] / len(path) * 1e3:.2f} ms/frame")
+    if mismatched:
+        sys.exit(1)
+
+
+def bench_caps(args):
+    """Per-segment cost of round caps for the level pen size, drawn as circles or blitted stamps."""
+    # A random walk of level-like strokes, 5 to 40 units long
+    rng = random.Random(1)
+    x = y = 0
+    points = []
+    for _ in range(2001):
+        x = min(230, max(-230, x + rng.uniform(-40, 40)))
+        y = min(170, max(-170, y + rng.uniform(-10, 10)))
+        points.append(scratch_to_pygame_coordinates(x, y))
+    pen_size = 5
+    color = pygame.Color(LEVEL_COLOR)
+    radius = round(round(pen_size * SCALE_FACTOR) / 2)
+    # The disc pygame.draw.circle draws, on a colorkeyed RLE surface: a circle
+    # centred at (x, y) covers the stamp placed at (int(x) - radius, int(y) - radius)
+    stamp = pygame.Surface((2 * radius + 1, 2 * radius + 1))
+    key_color = (color.r ^ 0xFF, color.g, color.b)
+    stamp.fill(key_color)
+    stamp.set_colorkey(key_color, pygame.RLEACCEL)
+    pygame.draw.circle(stamp, color, (radius, radius), radius)
+
+    def draw_lines(surface):
+        for start, end in zip(points, points[1:]):
+            draw_rounded_line(surface, color, start, end, pen_size)
+
+    def draw_polyline(surface):
+        draw_rounded_polyline(surface, color, points, pen_size)
+
+    def draw_cap_circles(surface):
+        for point in points:
+            pygame.draw.circle(surface, color, point, radius)
+
+    def draw_cap_stamps(surface):
+        # Placing the stamps is part of their cost
+        surface.fblits([(stamp, (int(x) - radius, int(y) - radius)) for x, y in points])
+
+    print(f"{'method':<24}{'us/segment':>12}")
+    surfaces = {}
+    for name, function in (("draw_rounded_line", draw_lines),
+                           ("draw_rounded_polyline", draw_polyline),
+                           ("caps, circles", draw_cap_circles),
+                           ("caps, stamps (fblits)", draw_cap_stamps)):
+        surface = pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT))
+        surface.fill(BACKGROUND_COLOR)
+        elapsed = min(_time_per_call(lambda: function(surface), args.repeat) for _ in range(5))
+        surfaces[name] = pygame.image.tobytes(surface, "RGB")
+        print(f"{name:<24}{elapsed / (len(points) - 1) * 1e6:>12.2f}")
+    if surfaces["draw_rounded_line"] != surfaces["draw_rounded_polyline"] \
+            or surfaces["caps, circles"] != surfaces["caps, stamps (fblits)"]:
+        print("MISMATCH: the methods drew different pixels")
+        sys.exit(1)
+
+
+# Bytes a segment may allocate while it is drawn (peak above the baseline)
+SEGMENT_ALLOCATION_BUDGET = 512
+
+
+def check_allocations(args):
+    """Check that drawing a segment stays within its allocation budget."""
+    surface = pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT))
+    pen = ScratchPen(surface)
+    # An untracked color, drawn with nothing tracked beneath it
+    pen.set_pen_color("#ffffff")
+    pen.set_pen_size(5)
+    rng = random.Random(1)
+    points = [(rng.uniform(-230, 230), rng.uniform(-170, 170)) for _ in range(500)]
+    pygame_points = [scratch_to_pygame_coordinates(x, y) for x, y in points]
+    color = pygame.Color(LEVEL_COLOR)
+
+    def draw_lines(i):
+        draw_rounded_line(surface, color, pygame_points[i - 1], pygame_points[i], 5)
+
+    def pen_gotos(i):
+        pen.goto(*points[i])
+
+    # The analytic backend drops air drawn over air, which keeps collision
+    # out of the numbers
+    scratch_pen.select_collision_backend("analytic")
+    pen.pen_down()
+    failed = False
+    print(f"{'path':<20}{'mean bytes':>12}{'max bytes':>12}")
+    for name, function in (("draw_rounded_line", draw_lines), ("ScratchPen.goto", pen_gotos)):
+        function(1)  # Warm up caches and free lists
+        tracemalloc.start()
+        peaks = []
+        for i in range(1, len(points)):
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            function(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+        print(f"{name:<20}{sum(peaks) / len(peaks):>12.1f}{max(peaks):>12}")
+        failed = failed or max(peaks) > SEGMENT_ALLOCATION_BUDGET
+    scratch_pen.select_collision_backend(COLLISION_BACKEND)
+    if failed:
+        print(f"FAIL: a segment allocated more than {SEGMENT_ALLOCATION_BUDGET} bytes")
+        sys.exit(1)
+
+
+def bench_landing(args):
+    """Backing out of the ground on landing: the one-unit loop against one query."""
+    pen = ScratchPen(pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT)))
+
+    def loop_landing():
+        steps = 0
+        while pen.touching_color(LEVEL_COLOR, HITBOX_ROUND) and pen.y <= 170:
+            pen.change_y_by(1)
+            steps += 1
+        return steps
+
+    def query_landing():
+        return pen.rise_until_clear(LEVEL_COLOR, HITBOX_ROUND, 170)
+
+    # Each landing is replayed args.repeat times; the loop must not get its
+    # answers from the touching_color memo
+    scratch_pen.TOUCH_MEMO = False
+
+    print(f"{'backend':<18}{'landings':>10}{'mean steps':>12}{'loop us':>10}{'query us':>10}")
+    failed = False
+    for backend, engine in (("raster", "python"), ("raster", "bitset"), ("raster", "numpy"),
+                            ("analytic", GRID_ENGINE), ("sdf", GRID_ENGINE)):
+        if (engine == "numpy" or backend == "sdf") and scratch_pen.numpy is None:
+            continue
+        scratch_pen.select_grid_engine(engine)
+        scratch_pen.select_collision_backend(backend)
+        # Every probe point that is touching the ground, as a landing would be
+        samples = []
+        for level_number, x, y, move in SAMPLE_POSITIONS + RESTING_POSITIONS:
+            _draw_frame(pen, level_number, x, y, move)
+            landings = []
+            for pen.x, pen.y in PROBE_OFFSETS:
+                if pen.touching_color(LEVEL_COLOR, HITBOX_ROUND):
+                    landings.append((pen.x, pen.y))
+            times = {}
+            for name, function in (("loop", loop_landing), ("query", query_landing)):
+                results = []
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    results.clear()
+                    for pen.x, pen.y in landings:
+                        results.append((function(), pen.y))
+                times[name] = time.perf_counter() - start
+                if name == "loop":
+                    expected = list(results)
+            failed = failed or results != expected
+            samples.append((len(landings), sum(steps for steps, _ in expected), times))
+        count = sum(sample[0] for sample in samples)
+        steps = sum(sample[1] for sample in samples)
+        loop_time = sum(sample[2]["loop"] for sample in samples) / (count * args.repeat)
+        query_time = sum(sample[2]["query"] for sample in samples) / (count * args.repeat)
+        print(f"{backend + '/' + engine:<18}{count:>10}{steps / count:>12.1f}"
+              f"{loop_time * 1e6:>10.1f}{query_time * 1e6:>10.1f}")
+    scratch_pen.select_grid_engine(GRID_ENGINE)
+    scratch_pen.select_collision_backend(COLLISION_BACKEND)
+    scratch_pen.TOUCH_MEMO = TOUCH_MEMO
+    if failed:
+        print("MISMATCH: the query landed somewhere else than the loop")
+        sys.exit(1)
+
+
+def bench_present(args):
+    """Frame presentation cost at the native render size and at a lower one."""
+    display = pygame.display.set_mode((NATIVE_WIDTH, NATIVE_HEIGHT))
+    native = pygame.Surface((NATIVE_WIDTH, NATIVE_HEIGHT))
+    half = pygame.Surface((NATIVE_WIDTH // 2, NATIVE_HEIGHT // 2))
+
+    def scale_and_blit():
+        # The old path: an identity scale into a new surface, then a blit
+        display.blit(pygame.transform.scale(native, (NATIVE_WIDTH, NATIVE_HEIGHT)), (0, 0))
+
+    print(f"{'path':<32}{'ms/frame':>10}")
+    for name, function in (("identity scale + blit", scale_and_blit),
+                           (f"present {native.get_width()}x{native.get_height()}",
+                            lambda: nrrender.present_frame(display, native)),
+                           (f"present {half.get_width()}x{half.get_height()} (scaled)",
+                            lambda: nrrender.present_frame(display, half))):
+        elapsed = min(_time_per_call(function, args.repeat * 20) for _ in range(5))
+        print(f"{name:<32}{elapsed * 1e3:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Neon Ride micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per measurement")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("grid", help=bench_grid.__doc__).set_defaults(func=bench_grid)
+    subparsers.add_parser("collision", help=check_collision.__doc__).set_defaults(func=check_collision)
+    subparsers.add_parser("scroll", help=bench_scroll.__doc__).set_defaults(func=bench_scroll)
+    subparsers.add_parser("caps", help=bench_caps.__doc__).set_defaults(func=bench_caps)
+    subparsers.add_parser("alloc", help=check_allocations.__doc__).set_defaults(func=check_allocations)
+    subparsers.add_parser("landing", help=bench_landing.__doc__).set_defaults(func=bench_landing)
+    subparsers.add_parser("present", help=bench_present.__doc__).set_defaults(func=bench_present)
+    args = parser.parse_args()
+    pygame.init()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@
 from nrutil import *
 from scratch_pen import *
 from nrlevels import *
+from nrrender import *
+from nrinput import *
 from nrconstants import *
 
 import pygame
@@ -45,6 +47,44 @@ size = 0
 current_direction_magic_number = 112
 last_jump_time = 0
 
+# Idle-frame detection: the fingerprint of the last game frame that left
+# everything it reads unchanged (None when there is no such frame)
+idle_fingerprint = None
+game_frames = 0
+game_frames_skipped = 0
+
+# Fixed-timestep simulation: game_screen() is one step of SIMULATION_STEP
+# seconds, run as often as the time since the last drawn frame asks for
+SIMULATION_STEP = 1 / SIMULATION_RATE
+simulation_clock = None  # time.perf_counter() at the last frame, None to start afresh
+simulation_lag = 0.0     # Seconds the simulation is behind the clock
+simulation_steps = 0     # Steps run for the last drawn frame
+simulation_dropped = 0.0 # Seconds given up to the step cap, in total
+frame_deadline = None    # time.perf_counter() the last paced frame was due to end
+
+# (level, x, y, move) the last two steps drew the level at, and what the
+# last step drew over it, for camera interpolation
+camera_previous = None
+camera_current = None
+foreground_strokes = []
+
+# Window visibility: a minimized, hidden or unfocused window is paused
+window_hidden = False
+window_focused = True
+pause_started = None
+# CPU and wall-clock seconds spent in each state, for the debug overlay
+state_cpu_time = {}
+state_wall_time = {}
+STATE_NAMES = {
+    STATE_ANIMATION: "animation",
+    STATE_WAITING_FOR_INPUT: "waiting",
+    STATE_GAME_SCREEN: "game",
+    STATE_INSTRUCTION_SCREEN: "instructions",
+    STATE_EMERGENCY: "emergency",
+    STATE_MENU_SCREEN: "menu",
+}
+
+
 # Function to print debug messages
 def debug_print(*args, **kwargs):
     if DEBUG:
@@ -69,7 +109,7 @@ pygame.mixer.init()
 screen = pygame.display.set_mode((NATIVE_WIDTH, NATIVE_HEIGHT), pygame.RESIZABLE | pygame.SCALED, vsync=1)
 
 # Create an output buffer
-output_buffer = pygame.Surface((NATIVE_WIDTH, NATIVE_HEIGHT))
+output_buffer = pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT))
 
 # Frame rate control
 clock = pygame.time.Clock()
@@ -83,6 +123,18 @@ def draw_debug_overlay(fps):
         f"Pygame: {pygame.version.ver}",
         f"FPS: {round(fps)}",
         f"X: {x}, Y: {y}",
+        f"Segments: {pen.segments_drawn} drawn, {pen.segments_culled} culled",
+        f"Tiles: {level_tiles.hits} hits, {level_tiles.misses} misses, {level_tiles.evictions} evictions, "
+        f"{level_tiles.bytes_used / (1024 * 1024):.1f} MB",
+        f"Glyphs: {glyph_atlas.hits} hits, {glyph_atlas.misses} misses, {glyph_atlas.evictions} evictions",
+        f"Screens: {screen_cache.hits} hits, {screen_cache.misses} misses",
+        f"Idle frames: {game_frames_skipped} of {game_frames} skipped "
+        f"({100 * game_frames_skipped / max(1, game_frames):.0f}%)",
+        f"Simulation: {simulation_steps} steps this frame, {simulation_dropped:.1f} s dropped",
+        f"Touching: {pen.touch_hits} of {pen.touch_queries} from the memo "
+        f"({100 * pen.touch_hits / max(1, pen.touch_queries):.0f}%)",
+        "CPU: " + ", ".join(f"{STATE_NAMES.get(state, state)} {100 * cpu_time / max(state_wall_time[state], 1e-9):.0f}%"
+                            for state, cpu_time in state_cpu_time.items()),
         f"{string_pressed_keys()}"
     ]
 
@@ -112,49 +164,8 @@ if SKIP_START_ANIMATION:
 
 
 ## Input functions
-# Function to check if a key is pressed
-def check_key_pressed(key):
-    """
-    Check if a specific key is pressed.
-    
-    Args:
-        key (str or int): The key to check. Can be a character (e.g., 'a') or a Pygame key constant (e.g., pygame.K_LEFT).
-    
-    Returns:
-        bool: True if the key is pressed, False otherwise.
-    
-    Raises:
-        ValueError: If the key is invalid.
-    """
-    # Get the current state of all keys
-    keys = pygame.key.get_pressed()
-    
-    # Handle arrow keys and other special keys
-    if isinstance(key, str):
-        # Convert the input character to its corresponding pygame key code
-        if key.lower() in ['left', 'right', 'up', 'down']:
-            # Map arrow key names to Pygame constants
-            arrow_keys = {
-                'left': pygame.K_LEFT,
-                'right': pygame.K_RIGHT,
-                'up': pygame.K_UP,
-                'down': pygame.K_DOWN
-            }
-            key_code = arrow_keys.get(key.lower())
-        else:
-            # Handle regular alphanumeric keys
-            key_code = getattr(pygame, f'K_{key.lower()}', None)
-    elif isinstance(key, int):
-        # Assume the input is already a Pygame key constant
-        key_code = key
-    else:
-        raise ValueError(f"Invalid key type: {type(key)}. Expected str or int.")
-    
-    if key_code is None:
-        raise ValueError(f"The key '{key}' is not a valid key.")
-
-    # Check if the specified key is pressed
-    return keys[key_code]
+# The bound actions held down this frame (see KEY_BINDINGS)
+game_input = InputSnapshot()
 ## End of input functions
 
 
@@ -290,19 +301,25 @@ def start_animation(state):
             pen.pen_up()
         elif 17 <= state <= 26:
             # Flash the title
-            # Lit
-            if state % 2 == 1:
-                load_message_at(pen, "Neon/Ride", -200, -50, 300, 0)
-            # Not lit
-            else:
-                load_message_at(pen, "Neon/Ride", -200, -50, 300, ZERO_POINT_ONE_COLOR)
+            # Every lit (or unlit) frame is the same, so each is only drawn once
+            lit = state % 2 == 1
+            if not screen_cache.restore(pen, "title", lit):
+                # Lit
+                if lit:
+                    load_message_at(pen, "Neon/Ride", -200, -50, 300, 0)
+                # Not lit
+                else:
+                    load_message_at(pen, "Neon/Ride", -200, -50, 300, ZERO_POINT_ONE_COLOR)
+                screen_cache.save(pen, "title", lit)
             
             # Set the next timer
             pygame.time.set_timer(START_ANIMATION_TIMER, 30)
             setup_complete = True
         elif state == 27:
             # Light up the title
-            load_message_at(pen, "Neon/Ride", -200, -50, 300, 0)
+            if not screen_cache.restore(pen, "title", True):
+                load_message_at(pen, "Neon/Ride", -200, -50, 300, 0)
+                screen_cache.save(pen, "title", True)
             pygame.time.set_timer(START_ANIMATION_TIMER, 3000)
             setup_complete = True
         elif 28 <= state <= 43:
@@ -344,8 +361,8 @@ def start_animation(state):
             # Invalid state, draw debug text
             font = pygame.font.SysFont('Arial', 24)
             text_surface = font.render("Invalid start animation state: " + str(state), True, (255, 0, 0))
-            text_rect = text_surface.get_rect(center=(NATIVE_WIDTH // 2, NATIVE_HEIGHT // 2))  # Center the text
-            screen.blit(text_surface, text_rect)  # Draw the text at the centered position
+            text_rect = text_surface.get_rect(center=(RENDER_WIDTH // 2, RENDER_HEIGHT // 2))  # Center the text
+            output_buffer.blit(text_surface, text_rect)  # Draw the text at the centered position
 
 # Menu screen
 def menu_screen():
@@ -353,13 +370,17 @@ def menu_screen():
     global current_state
 
     if not setup_complete:
+        # The username is the only input; its length also picks the color
+        clean_username = ''.join(filter(str.isalnum, get_username()))
+        if screen_cache.restore(pen, "menu", clean_username):
+            setup_complete = True
+            return
         pen.erase_all()
         pen.set_pen_size(50)
         load_message_at(pen, "play", -210, 150, 500, 50)
         load_message_at(pen, "instructions", -220, -70, 200, "#7F01FF")
         load_message_at(pen, "press/in/case", 110, 30, 50, 0)
         load_message_at(pen, "of/emergency", 113, 10, 50, 0)
-        clean_username = ''.join(filter(str.isalnum, os.getlogin()))
         welcome_string = "Welcome/" + clean_username + "..."
         load_message_at(pen, welcome_string, 240 - len(welcome_string) * 7.5, -150, 50, len(clean_username) * 141)
         pen.goto(155, 90)
@@ -368,16 +389,17 @@ def menu_screen():
         pen.pen_down()
         pen.move(1)
         pen.pen_up()
+        screen_cache.save(pen, "menu", clean_username)
         setup_complete = True
 
 # Draw the grid
-def draw_grid():
+def draw_grid(camera_x, camera_y):
     pen.set_pen_size(1)
     pen.set_pen_color("#656565")
     pen.pen_up()
 
     # Vertical lines
-    start_x = -240 + (x % grid_size)
+    start_x = -240 + (camera_x % grid_size)
     for i in range((NATIVE_WIDTH // grid_size) + 2):
         current_x = start_x + i * grid_size
         pen.goto(current_x, -180)
@@ -386,7 +408,7 @@ def draw_grid():
         pen.pen_up()
 
     # Horizontal lines
-    start_y = -180 + (y % grid_size)
+    start_y = -180 + (camera_y % grid_size)
     for i in range((NATIVE_HEIGHT // grid_size) + 2):
         current_y = start_y + i * grid_size
         pen.goto(-240, current_y)
@@ -416,15 +438,16 @@ def fall():
         pen.pen_up()
         # "remember" is a ground correction offset
         remember = 0
-        while pen.touching_color(LEVEL_COLOR, HITBOX_ROUND) and pen.y <= 170:
-            y -= 1              # Move the logical position up one unit at a time
-            pen.change_y_by(1)  # Move the pen in screen space the same amount
-            remember -= 1
+        # Move the pen up out of the ground in one collision query
+        steps = pen.rise_until_clear(LEVEL_COLOR, HITBOX_ROUND, 170)
+        for _ in range(steps):
+            y -= 1              # Move the logical position up the same amount, unit by unit
+        remember -= steps
         pen.change_y_by(remember)  # Re-apply offset to keep pen aligned with logical y
         y += 4                     # Small push up so we are definitely above ground
         pen.pen_down()
         # Jump only if up is pressed and the 0.25s cooldown expired
-        if check_key_pressed("up") and (time.time() - last_jump_time) >= 0.25:
+        if game_input.pressed(ACTION_UP) and (time.time() - last_jump_time) >= 0.25:
             last_jump_time = time.time()
             jump = JUMP_HEIGHT
             y -= JUMP_HEIGHT
@@ -432,7 +455,7 @@ def fall():
         if not falling:
             # First frame of air time: reset timer and capture any buffered jump
             time_global = 0
-            if check_key_pressed("up"):
+            if game_input.pressed(ACTION_UP):
                 jump = JUMP_HEIGHT
             else:
                 jump = 0
@@ -478,25 +501,25 @@ def sensing():
         else:
             if pen.direction == DIR_RIGHT_CHECK:
                 # Rightward motion: accelerate left in Scratch coords (negative x), stop on wall
-                if check_key_pressed("right") and not (pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL) and xvel < 0):
+                if game_input.pressed(ACTION_RIGHT) and not (pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL) and xvel < 0):
                     xvel -= HORIZ_SPEED
                 if pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL):
                     if xvel < 0:
                         xvel = 0
                     # Wall jump-ish assist: tiny kick if holding up+left while against right wall
-                    if check_key_pressed("up") and check_key_pressed("left"):
+                    if game_input.pressed(ACTION_UP | ACTION_LEFT):
                         time_global = 0.1
                         xvel = HORIZ_SPEED
             else:
                 if pen.direction == DIR_LEFT_CHECK:
                     # Leftward motion: accelerate right in Scratch coords (positive x), stop on wall
-                    if check_key_pressed("left") and not (pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL) and xvel > 0):
+                    if game_input.pressed(ACTION_LEFT) and not (pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL) and xvel > 0):
                         xvel += HORIZ_SPEED
                     if pen.touching_color(LEVEL_COLOR, HITBOX_HORIZONTAL):
                         if xvel > 0:
                             xvel = 0
                         # Wall jump-ish assist: tiny kick if holding up+right while against left wall
-                        if check_key_pressed("up") and check_key_pressed("right"):
+                        if game_input.pressed(ACTION_UP | ACTION_RIGHT):
                             time_global = 0.1
                             xvel = -HORIZ_SPEED
 
@@ -504,13 +527,13 @@ def sensing():
 def debug_fly():
     global x, y
     # Use W, A, S, D keys to move the character in debug mode
-    if check_key_pressed('w'):
+    if game_input.pressed(ACTION_FLY_UP):
         y -= 1
-    if check_key_pressed('s'):
+    if game_input.pressed(ACTION_FLY_DOWN):
         y += 1
-    if check_key_pressed('a'):
+    if game_input.pressed(ACTION_FLY_LEFT):
         x += 1
-    if check_key_pressed('d'):
+    if game_input.pressed(ACTION_FLY_RIGHT):
         x -= 1
 
 # Function that draws the character in the game
@@ -544,16 +567,50 @@ def timeout_tick():
     time_global += 0.05
     move += 1
     # Check if time up or 'r' key is pressed
-    if y > 500 or check_key_pressed('r'):
+    if y > 500 or game_input.pressed(ACTION_RESTART):
         death()
 
-# Game screen
+# Everything a game frame reads, apart from move (only the moving parts of a
+# level read that). A frame that starts and ends with the same fingerprint
+# changes nothing, so the next frame with that fingerprint would draw the same
+# pixels and collide the same way.
+def game_fingerprint():
+    return (x, y, xvel, level, grid, grid_size, t_pressed, q_pressed, enter_exit, falling,
+            time_global, jump, remember, current_state,
+            move if compile_level(level).moving_function is not None else None,
+            (time.time() - last_jump_time) >= 0.25,
+            game_input.actions,
+            pen.x, pen.y, pen.direction, pen.pen_down_status, pen.pen_size, tuple(pen.pen_color))
+
+# Game screen, skipping frames that would repeat the previous one
 def game_screen():
+    global idle_fingerprint, game_frames, game_frames_skipped, move, camera_previous
+    game_frames += 1
+    if not IDLE_FRAME_SKIP:
+        game_frame()
+        return
+    fingerprint = game_fingerprint()
+    if fingerprint == idle_fingerprint:
+        # output_buffer and the collision grid already hold this frame; of
+        # timeout_tick's work only move is not part of the fingerprint
+        game_frames_skipped += 1
+        move += 1
+        camera_previous = camera_current
+        return
+    game_frame()
+    idle_fingerprint = fingerprint if game_fingerprint() == fingerprint else None
+
+def game_frame():
     global x, y, xvel, level, grid, t_pressed, q_pressed, enter_exit, falling, start, grid_size, current_state, setup_complete
+    global camera_previous, camera_current
     pen.erase_all()
     if grid:
-        draw_grid()
+        draw_grid(x, y)
     load_level(level, x, y, pen, move)
+    camera_previous, camera_current = camera_current, (level, x, y, move)
+    # Everything drawn from here on stays put on screen when the camera moves
+    foreground_strokes.clear()
+    pen.stroke_log = foreground_strokes
     draw_character_with_sensing()
 
     # Debug prints to verify xvel and y
@@ -562,9 +619,13 @@ def game_screen():
     # Apply xvel to x
     x += xvel
     xvel /= 1.5  # Apply friction to xvel
+    # Friction alone never reaches 0; what is left below 1e-3 moves x and the
+    # eyes by under 0.002 units in all, so stop it and let idle frames skip
+    if abs(xvel) < 1e-3:
+        xvel = 0
 
     # Handle grid size toggle
-    if check_key_pressed('t'):
+    if game_input.pressed(ACTION_GRID):
         if not t_pressed:
             t_pressed = True
             if grid_size > 150:
@@ -575,7 +636,7 @@ def game_screen():
         t_pressed = False
 
     # Handle emergency quit
-    if check_key_pressed('q'):
+    if game_input.pressed(ACTION_QUIT):
         q_pressed += 1
         if q_pressed >= 80:
             pen.pen_up()
@@ -593,6 +654,7 @@ def game_screen():
         load_message_at(pen, "exiting...", 140, -150, 60, 0)
     else:
         q_pressed = 0
+    pen.stroke_log = None
 
     timeout_tick()
     
@@ -601,6 +663,70 @@ def game_screen():
     # ANSWER: The variables that must be passed to the load_level function in nrlevels.py are the level number and the pen object.
     
 
+# Run as many fixed game steps as the time since the last drawn frame calls for
+def simulate_game():
+    global simulation_clock, simulation_lag, simulation_steps, simulation_dropped
+    now = time.perf_counter()
+    if simulation_clock is None:
+        # Entering the game (or back from a pause): one step straight away
+        simulation_lag = SIMULATION_STEP
+    else:
+        simulation_lag += now - simulation_clock
+    simulation_clock = now
+
+    simulation_steps = 0
+    # The lag is rounded to whole steps and the difference carried, so a
+    # frame within half a step of one step long runs exactly one: jitter in
+    # frame times does not turn into frames of 0 and 2 steps
+    while simulation_lag >= SIMULATION_STEP / 2 and current_state == STATE_GAME_SCREEN:
+        if simulation_steps == MAX_SIMULATION_STEPS:
+            # Too far behind to catch up: slow down rather than spiral
+            simulation_dropped += simulation_lag
+            simulation_lag = 0.0
+            break
+        game_screen()
+        simulation_lag -= SIMULATION_STEP
+        simulation_steps += 1
+
+    if INTERPOLATE_CAMERA and current_state == STATE_GAME_SCREEN:
+        # The last step is up to half a step ahead of the clock (or behind it)
+        draw_interpolated_camera(max(0.0, min(1.0, simulation_lag / SIMULATION_STEP + 0.5)))
+
+# Wait out the rest of a 1 / rate second game frame. clock.tick waits whole
+# milliseconds (16 at 60 fps), which would draw frames faster than the
+# simulation steps; waiting for deadlines 1 / rate apart keeps frames 1 / rate
+# long on average, however each wait rounds.
+def pace_frame(rate):
+    global frame_deadline
+    now = time.perf_counter()
+    if frame_deadline is None or now - frame_deadline > 1 / rate:
+        # Starting out, or a frame or more late: do not rush to catch up
+        frame_deadline = now
+    else:
+        frame_deadline += 1 / rate
+        pygame.time.wait(int(min(frame_deadline - now, 1 / rate) * 1000))
+    # Keeps clock.get_fps() measuring
+    clock.tick()
+
+# Redraw the level part of the way from the previous step's camera offset to
+# the last one (alpha 0 to 1), with the character and text left where the
+# last step drew them. Collision keeps the last step's state.
+def draw_interpolated_camera(alpha):
+    if camera_previous is None or camera_current is None:
+        return
+    level_before, x_before, y_before, _ = camera_previous
+    level_now, x_now, y_now, move_now = camera_current
+    if level_before != level_now or (x_before, y_before) == (x_now, y_now):
+        return
+    camera_x = x_before + (x_now - x_before) * alpha
+    camera_y = y_before + (y_now - y_before) * alpha
+    pen.surface.fill(BACKGROUND_COLOR)
+    pen.blank = True
+    if grid:
+        draw_grid(camera_x, camera_y)
+    load_level(level_now, camera_x, camera_y, pen, move_now, collide=False)
+    pen.draw_segments(foreground_strokes, collide=False)
+
 # Invalid state screen
 def invalid_state_screen():
     global setup_complete
@@ -611,12 +737,78 @@ def invalid_state_screen():
         # Invalid state, draw debug text
         font = pygame.font.SysFont('Arial', 24)
         text_surface = font.render("Invalid game state: " + str(current_state), True, (255, 0, 0))
-        text_rect = text_surface.get_rect(center=(NATIVE_WIDTH // 2, NATIVE_HEIGHT // 2))  # Center the text
+        text_rect = text_surface.get_rect(center=(RENDER_WIDTH // 2, RENDER_HEIGHT // 2))  # Center the text
         output_buffer.blit(text_surface, text_rect)  # Draw the text at the centered position
         setup_complete = True
         
 ## End of screens 'n' stuff
 
+# Handle one event from the queue
+def process_event(event):
+    global running, animation_step, setup_complete, current_state, window_hidden, window_focused
+    if event.type == pygame.QUIT:
+        running = False
+    elif event.type in (pygame.WINDOWMINIMIZED, pygame.WINDOWHIDDEN):
+        window_hidden = True
+    elif event.type in (pygame.WINDOWRESTORED, pygame.WINDOWMAXIMIZED, pygame.WINDOWSHOWN):
+        window_hidden = False
+    elif event.type == pygame.WINDOWFOCUSLOST:
+        window_focused = False
+    elif event.type == pygame.WINDOWFOCUSGAINED:
+        window_focused = True
+    elif event.type == pygame.KEYDOWN:
+        debug_print(f"Key down: {pygame.key.name(event.key)}")
+    elif event.type == pygame.KEYUP:
+        debug_print(f"Key up: {pygame.key.name(event.key)}")
+    elif event.type == START_ANIMATION_TIMER:
+        animation_step += 1
+        pygame.time.set_timer(START_ANIMATION_TIMER, 0)
+        setup_complete = False
+
+    # Mouse event handler on the menu screen
+    # Handle mouse clicks for the menu screen
+    elif event.type == pygame.MOUSEBUTTONDOWN:
+        if current_state == STATE_MENU_SCREEN:
+            mouse_x, mouse_y = event.pos
+            scratch_x, scratch_y = display_to_scratch_coordinates(mouse_x, mouse_y)
+            debug_print(f"Mouse clicked at ({scratch_x}, {scratch_y})")
+            
+            # Check Play button (approximate coordinates)
+            if scratch_x < 80 and scratch_y > -30:
+                current_state = STATE_GAME_SCREEN
+                setup_complete = False
+                debug_print("Switching to game screen")
+            # Check Instructions button
+            elif scratch_x < 140 and scratch_y < -60:
+                current_state = STATE_INSTRUCTION_SCREEN
+                setup_complete = False
+                debug_print("Switching to instruction screen")
+            # Check Emergency button (circle around (155, 90))
+            elif math.sqrt((scratch_x - 155)**2 + (scratch_y - 90)**2) < 40:
+                current_state = STATE_EMERGENCY
+                setup_complete = False
+                debug_print("Switching to emergency state")
+            else:
+                debug_print("Clicked outside buttons")
+
+# True while the game should neither simulate nor render
+def window_paused():
+    return window_hidden or (PAUSE_ON_FOCUS_LOSS and not window_focused)
+
+# Pick up where the game left off after a pause
+def resume_from_pause():
+    global last_jump_time, pause_started, simulation_clock
+    paused_for = time.time() - pause_started
+    # The jump cooldown is the only wall-clock timer; time_global and move
+    # count frames and simply did not advance
+    last_jump_time += paused_for
+    pause_started = None
+    debug_print(f"Resumed after {paused_for:.1f} s paused")
+    # Forget the paused time so the first frame is not paced against it,
+    # and the simulation does not try to catch up on it
+    clock.tick()
+    simulation_clock = None
+
 # Main game loop
 running = True
 fullscreen = True
@@ -639,52 +831,52 @@ if os.path.exists(music_path):
     pygame.mixer.music.play(-1)
 
 while running:
-    # Clear the screen
-    screen.fill(BACKGROUND_COLOR)
-    
+    # A paused window keeps its last frame and only waits for events
+    if window_paused():
+        if pause_started is None:
+            pause_started = time.time()
+            debug_print("Paused while the window is hidden or unfocused")
+        event = pygame.event.wait(PAUSED_WAIT_MS)
+        if event.type != pygame.NOEVENT:
+            process_event(event)
+        for event in pygame.event.get():
+            process_event(event)
+        if not window_paused():
+            resume_from_pause()
+        elif not window_hidden:
+            # Keep the frame on an unfocused window intact if it gets uncovered
+            pygame.display.flip()
+        continue
+
+    frame_state = current_state
+    frame_cpu_start = time.process_time()
+    frame_wall_start = time.perf_counter()
+
+    # No need to clear the screen: present_frame covers all of it
+    pen.reset_frame_stats()
+
+    tick_rate, continuous = STATE_SCHEDULE.get(current_state, (60, True))
+    # A static screen that is already drawn sleeps until something happens
+    if not continuous and setup_complete:
+        event = pygame.event.wait(IDLE_WAIT_MS)
+        if event.type != pygame.NOEVENT:
+            process_event(event)
+
     # Do not change any pen settings in the main loop.
     for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            debug_print(f"Key down: {pygame.key.name(event.key)}")
-        elif event.type == pygame.KEYUP:
-            debug_print(f"Key up: {pygame.key.name(event.key)}")
-        elif event.type == START_ANIMATION_TIMER:
-            animation_step += 1
-            pygame.time.set_timer(START_ANIMATION_TIMER, 0)
-            setup_complete = False
-    
-        # Mouse event handler on the menu screen
-        # Handle mouse clicks for the menu screen
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            if current_state == STATE_MENU_SCREEN:
-                mouse_x, mouse_y = event.pos
-                scratch_x, scratch_y = pygame_to_scratch_coordinates(mouse_x, mouse_y)
-                debug_print(f"Mouse clicked at ({scratch_x}, {scratch_y})")
-                
-                # Check Play button (approximate coordinates)
-                if scratch_x < 80 and scratch_y > -30:
-                    current_state = STATE_GAME_SCREEN
-                    setup_complete = False
-                    debug_print("Switching to game screen")
-                # Check Instructions button
-                elif scratch_x < 140 and scratch_y < -60:
-                    current_state = STATE_INSTRUCTION_SCREEN
-                    setup_complete = False
-                    debug_print("Switching to instruction screen")
-                # Check Emergency button (circle around (155, 90))
-                elif math.sqrt((scratch_x - 155)**2 + (scratch_y - 90)**2) < 40:
-                    current_state = STATE_EMERGENCY
-                    setup_complete = False
-                    debug_print("Switching to emergency state")
-                else:
-                    debug_print("Clicked outside buttons")
+        process_event(event)
+    game_input.update()
+
+    # Other screens draw over the last game frame
+    if current_state != STATE_GAME_SCREEN:
+        idle_fingerprint = None
+        simulation_clock = None
+        camera_previous = camera_current = None
 
     if current_state == STATE_ANIMATION:
         start_animation(animation_step)
     elif current_state == STATE_GAME_SCREEN:
-        game_screen()
+        simulate_game()
     elif current_state == STATE_INSTRUCTION_SCREEN:
         # Show message box saying it's not implemented yet
         show_system_message_box("Not Implemented Yet", "Instructions screen is not implemented yet.")
@@ -702,9 +894,8 @@ while running:
     else:
         invalid_state_screen()
 
-    # Blit the output buffer onto the main screen
-    scaled_buffer = pygame.transform.scale(output_buffer, (NATIVE_WIDTH, NATIVE_HEIGHT))
-    screen.blit(scaled_buffer, (0, 0))
+    # Put the output buffer on the main screen
+    present_frame(screen, output_buffer)
 
     # Calculate FPS
     fps = clock.get_fps()
@@ -714,7 +905,18 @@ while running:
         draw_debug_overlay(fps)
     
     pygame.display.flip()
-    clock.tick(60)
+    if frame_state == STATE_GAME_SCREEN:
+        pace_frame(tick_rate)
+    else:
+        clock.tick(tick_rate)
+
+    # CPU time over wall time spent in each state
+    state_cpu_time[frame_state] = state_cpu_time.get(frame_state, 0) + time.process_time() - frame_cpu_start
+    state_wall_time[frame_state] = state_wall_time.get(frame_state, 0) + time.perf_counter() - frame_wall_start
+
+for state, cpu_time in state_cpu_time.items():
+    debug_print(f"CPU in {STATE_NAMES.get(state, state)}: {cpu_time:.2f} s of {state_wall_time[state]:.2f} s "
+                f"({100 * cpu_time / max(state_wall_time[state], 1e-9):.0f}%)")
 
 # Quit Pygame
 pygame.quit()
\ No newline at end of file
@@ -3,6 +3,12 @@ NATIVE_WIDTH = 960
 NATIVE_HEIGHT = 720
 SCALE_FACTOR = 2
 ASPECT_RATIO = NATIVE_WIDTH / NATIVE_HEIGHT
+# Internal render resolution: the stage (480 x 360 Scratch units) is drawn at
+# SCALE_FACTOR pixels per unit, then presented at NATIVE_WIDTH x NATIVE_HEIGHT.
+# When the two sizes match, presenting is a single blit; otherwise it is one
+# scale straight into the display surface.
+RENDER_WIDTH = 480 * SCALE_FACTOR
+RENDER_HEIGHT = 360 * SCALE_FACTOR
 
 # Colors
 BACKGROUND_COLOR = (0, 0, 0)
@@ -33,9 +39,101 @@ STATE_INSTRUCTION_SCREEN = 3    # 'i' in the original game
 STATE_EMERGENCY = 4 # 'e' in the original game
 STATE_MENU_SCREEN = 5
 
+# The game simulates in fixed steps of 1 / SIMULATION_RATE seconds (the rate
+# its physics was tuned for), however often frames are drawn. A drawn frame
+# runs at most MAX_SIMULATION_STEPS steps; past that the game slows down
+# instead of falling ever further behind.
+SIMULATION_RATE = 60
+MAX_SIMULATION_STEPS = 5
+# Frames drawn per second on the game screen (vsync may hold it lower).
+# Above SIMULATION_RATE, INTERPOLATE_CAMERA scrolls the level smoothly
+# between steps, one step behind the simulation.
+GAME_RENDER_RATE = 60
+INTERPOLATE_CAMERA = False
+
+# Frame scheduling per state: (frames per second, redraws continuously).
+# A state that does not redraw continuously sleeps until an event arrives
+# (or IDLE_WAIT_MS passes) once its screen is drawn.
+STATE_SCHEDULE = {
+    STATE_ANIMATION: (60, False),   # Advanced by its timer events
+    STATE_WAITING_FOR_INPUT: (60, False),
+    STATE_GAME_SCREEN: (GAME_RENDER_RATE, True),
+    STATE_INSTRUCTION_SCREEN: (60, False),
+    STATE_EMERGENCY: (60, False),
+    STATE_MENU_SCREEN: (60, False),
+}
+IDLE_WAIT_MS = 250
+# A minimized or hidden window (and, with PAUSE_ON_FOCUS_LOSS, an unfocused
+# one) stops simulating and rendering, and polls for events this often
+PAUSED_WAIT_MS = 500
+PAUSE_ON_FOCUS_LOSS = True
+
 # Grid Settings
 GRID_SIZE = 100
 
+# Collision grid engine: "python" (bytearray), "bitset" (one int per row and
+# color) or "numpy" (optional, falls back to "python" when NumPy is not installed)
+GRID_ENGINE = "python"
+
+# Hitbox queries one color may scan on an unchanged grid before that color's
+# summed-area table is built, per engine; building one costs about as much
+# as this many scans (benchmark.py grid), and the game makes about 8 a frame
+GRID_AREA_TABLE_QUERIES = {"python": 2000, "numpy": 400}
+
+# Cell size (Scratch units) of the spatial hash over level segments
+SPATIAL_HASH_CELL_SIZE = 128
+
+# How static level geometry reaches the screen: "direct" (strokes drawn every
+# frame), "tiles" (pre-rendered world-space tiles blitted at the camera offset)
+# or "scroll" (last frame's level layer scrolled, exposed strips redrawn)
+LEVEL_RENDER_MODE = "direct"
+LEVEL_TILE_SIZE = 256       # Tile edge in Scratch units
+LEVEL_TILE_BUDGET_MB = 32   # Pixel memory the tile cache may hold
+
+# Pre-rendered letters kept for load_message_at
+GLYPH_ATLAS_SIZE = 256
+
+# Finished frames of static screens (menu, title) are cached in memory and,
+# when SCREEN_CACHE_ON_DISK is set, as PNGs in the user's cache directory.
+# Bump SCREEN_CACHE_VERSION whenever what those screens draw changes.
+SCREEN_CACHE_ON_DISK = True
+SCREEN_CACHE_VERSION = 1
+
+# Skip game frames whose inputs match a previous frame that changed nothing
+IDLE_FRAME_SKIP = True
+
+# Remember touching_color answers until the collision backend is written to
+TOUCH_MEMO = True
+
+# Keys bound to each game action, by pygame key name ("a", "left", "space"...)
+KEY_BINDINGS = {
+    "left": ("left",),
+    "right": ("right",),
+    "up": ("up",),
+    "down": ("down",),
+    "restart": ("r",),
+    "quit": ("q",),
+    "grid": ("t",),
+    "fly_up": ("w",),       # Flying (FLYING_ENABLED) only
+    "fly_left": ("a",),
+    "fly_down": ("s",),
+    "fly_right": ("d",),
+}
+
+# Collision backend: "raster" (the color grid above), "analytic" (hitbox
+# tested directly against stroke capsules; no grid cells are written) or
+# "sdf" (analytic, with a distance field over each level's static strokes;
+# needs NumPy, falls back to "analytic" without it). "raster" is the fastest
+# of the three; "sdf" only speeds up "analytic" (benchmark.py collision)
+COLLISION_BACKEND = "raster"
+
+# Distance fields store whole units within SDF_BAND of a stroke. With
+# SDF_CACHE_ON_DISK they are kept in the user's cache directory; bump
+# SDF_CACHE_VERSION whenever the way they are built changes.
+SDF_BAND = 32
+SDF_CACHE_ON_DISK = True
+SDF_CACHE_VERSION = 1
+
 # Debug Settings
 DEBUG = True
 FLYING_ENABLED = False
@@ -0,0 +1,92 @@
+import pygame
+from nrconstants import *
+
+
+## Actions
+# One bit per game action; a frame's input is the OR of the pressed ones
+ACTION_LEFT = 1 << 0
+ACTION_RIGHT = 1 << 1
+ACTION_UP = 1 << 2
+ACTION_DOWN = 1 << 3
+ACTION_RESTART = 1 << 4
+ACTION_QUIT = 1 << 5
+ACTION_GRID = 1 << 6
+ACTION_FLY_UP = 1 << 7
+ACTION_FLY_LEFT = 1 << 8
+ACTION_FLY_DOWN = 1 << 9
+ACTION_FLY_RIGHT = 1 << 10
+
+# Action names as used in KEY_BINDINGS
+ACTIONS = {
+    "left": ACTION_LEFT,
+    "right": ACTION_RIGHT,
+    "up": ACTION_UP,
+    "down": ACTION_DOWN,
+    "restart": ACTION_RESTART,
+    "quit": ACTION_QUIT,
+    "grid": ACTION_GRID,
+    "fly_up": ACTION_FLY_UP,
+    "fly_left": ACTION_FLY_LEFT,
+    "fly_down": ACTION_FLY_DOWN,
+    "fly_right": ACTION_FLY_RIGHT,
+}
+
+
+def key_code(key_name):
+    # Pygame key constant for a key name: "a" is K_a, "left" is K_LEFT
+    code = getattr(pygame, f"K_{key_name}", None)
+    if code is None:
+        code = getattr(pygame, f"K_{key_name.upper()}", None)
+    return code
+
+
+def resolve_bindings(bindings):
+    # (key code, action bit) for every bound key; unknown names are skipped
+    resolved = []
+    for action_name, key_names in bindings.items():
+        action = ACTIONS.get(action_name)
+        if action is None:
+            print(f"WARN: Unknown action '{action_name}' in the key bindings.")
+            continue
+        for key_name in key_names:
+            code = key_code(key_name)
+            if code is None:
+                print(f"WARN: Unknown key '{key_name}' bound to '{action_name}'.")
+                continue
+            resolved.append((code, action))
+    return tuple(resolved)
+
+
+## InputSnapshot class
+class InputSnapshot:
+    """
+    The game's bound actions as a bitmask, read from the keyboard once per frame.
+
+    update() reads pygame.key.get_pressed() once and sets the bit of every
+    action with a pressed key; pressed() is then a bit test. Key codes are
+    resolved from the binding table up front, not on every check.
+    """
+
+    def __init__(self, bindings=KEY_BINDINGS):
+        self.bindings = dict(bindings)
+        self._keys = resolve_bindings(self.bindings)
+        self.actions = 0
+
+    def update(self):
+        keys = pygame.key.get_pressed()
+        actions = 0
+        for code, action in self._keys:
+            if keys[code]:
+                actions |= action
+        self.actions = actions
+
+    def pressed(self, actions):
+        # True when every action in the mask is pressed
+        return self.actions & actions == actions
+
+    def rebind(self, action_name, key_names):
+        # Replaces the keys bound to one action; takes effect on the next update()
+        if action_name not in ACTIONS:
+            raise ValueError(f"Unknown action '{action_name}'.")
+        self.bindings[action_name] = tuple(key_names)
+        self._keys = resolve_bindings(self.bindings)
@@ -1,34 +1,96 @@
+import math
 from math import sin, radians
 import pygame
 from scratch_pen import *
 from nrconstants import *
 from nrutil import *
+from nrrender import *
 
 goal_x = [-1478, -2081, -1557, 1036, -2243, -3417, -2939, -1449]
 goal_y = [-512, -634, -463, -713, -763, -1511, -2, -609]
 
 MOVE_DIVISOR = 2
 
-def load_level(level: int, x: int, y: int, pen: ScratchPen, move: int) -> None:
+class CompiledLevel:
+    """
+    Retained-mode display list for one level.
+
+    The static part is recorded once, in level space, as
+    (start_x, start_y, end_x, end_y, pen_size, color, color_id) segments.
+    The moving part is re-recorded each frame for the current move value.
+    Drawing translates both lists by the camera offset.
+
+    A spatial hash over the static segments picks the ones near the stage
+    for drawing, and serves collision candidates to the analytic backend.
+    """
+
+    def __init__(self, level, static_function, moving_function=None):
+        self.level = level
+        recorder = RecordingPen()
+        static_function(0, 0, recorder)
+        self.static_segments = recorder.segments
+        self.moving_function = moving_function
+        self._moving_recorder = RecordingPen()
+
+        self.spatial_hash = SpatialHash()
+        self.static_capsules = []
+        count = len(self.static_segments)
+        for index, (start_x, start_y, end_x, end_y, size, color, color_id) in enumerate(self.static_segments):
+            # Same reach as the drawn stroke and as the grid's stamped discs
+            margin = max(size / 2 + 1, math.ceil(max(0.5, size / 2)))
+            self.spatial_hash.insert(index, min(start_x, end_x) - margin, min(start_y, end_y) - margin,
+                                     max(start_x, end_x) + margin, max(start_y, end_y) + margin)
+            radius = max(1, int(math.ceil(max(0.5, size / 2))))
+            self.static_capsules.append((start_x, start_y, end_x, end_y, radius, color_id, index - count))
+
+        # Per-frame culling counts from the last draw()
+        self.segments_drawn = 0
+        self.segments_skipped = 0
+
+    def moving_segments(self, move):
+        if self.moving_function is None:
+            return []
+        self._moving_recorder.erase_all()
+        self.moving_function(0, 0, self._moving_recorder, move)
+        return self._moving_recorder.segments
+
+    def visible_static_segments(self, x, y):
+        # Static segments whose reach overlaps the stage at camera offset (x, y)
+        indices = self.spatial_hash.query(-240 - x, -180 - y, 240 - x, 180 - y)
+        return [self.static_segments[index] for index in indices]
+
+    # With collide=False only the picture is drawn; collision is left as it was
+    def draw(self, pen, x, y, move, collide=True):
+        visible = self.visible_static_segments(x, y)
+        self.segments_drawn = len(visible)
+        self.segments_skipped = len(self.static_segments) - len(visible)
+        pen.segments_culled += self.segments_skipped
+        collide_static = collide and not use_static_collision_layer(self.spatial_hash, self.static_capsules, x, y)
+        render = LEVEL_RENDER_MODE not in ("tiles", "scroll")
+        if LEVEL_RENDER_MODE == "tiles":
+            level_tiles.draw(pen.surface, self.level, self, x, y)
+        elif LEVEL_RENDER_MODE == "scroll":
+            level_scroll_layer.draw(pen.surface, self.level, self, x, y, opaque=pen.blank)
+        if render or collide_static:
+            pen.draw_segments(visible, x, y, collide=collide_static, render=render)
+        if self.moving_function is not None:
+            pen.draw_segments(self.moving_segments(move), x, y, collide=collide)
+
+
+_compiled_levels = {}
+
+def compile_level(level: int) -> CompiledLevel:
+    compiled = _compiled_levels.get(level)
+    if compiled is None:
+        static_function, moving_function = LEVELS.get(level, (the_other_level, None))
+        compiled = CompiledLevel(level, static_function, moving_function)
+        _compiled_levels[level] = compiled
+    return compiled
+
+def load_level(level: int, x: int, y: int, pen: ScratchPen, move: int, collide: bool = True) -> None:
     move_internal = move / MOVE_DIVISOR
-    if level == 1:
-        level1(x, y, pen)
-    elif level == 2:
-        level2(x, y, pen, move_internal)
-    elif level == 3:
-        level3(x, y, pen)
-    elif level == 4:
-        level4(x, y, pen)
-    elif level == 5:
-        level5(x, y, pen)
-    elif level == 6:
-        level6(x, y, pen)
-    elif level == 7:
-        level7(x, y, pen)
-    elif level == 8:
-        level8(x, y, pen)
-    else:
-        the_other_level(x, y, pen)
+    compile_level(level).draw(pen, x, y, move_internal, collide)
+
 
 def level1(x: int, y: int, pen: ScratchPen) -> None:
     pen.set_pen_size(5)
@@ -80,11 +142,10 @@ def level1(x: int, y: int, pen: ScratchPen) -> None:
     pen.goto(200 + x, 30 + y)
     pen.goto(200 + x, 50 + y)
     pen.pen_up()
-    if not((abs(730 + x) > 235 and abs(730 + x) - 26 * 7.5 > 235) or abs(-150 + y) > 175):
-        load_message_at(pen, "wall/jump/to/climb/this/up", 730 + x, -150 + y, 50, ZERO_POINT_FIVE_COLOR)
-        pen.set_pen_color(LEVEL_COLOR)
+    load_message_at(pen, "wall/jump/to/climb/this/up", 730 + x, -150 + y, 50, ZERO_POINT_FIVE_COLOR)
+    pen.set_pen_color(LEVEL_COLOR)
 
-def level2(x: int, y: int, pen: ScratchPen, move: int) -> None:
+def level2(x: int, y: int, pen: ScratchPen) -> None:
     pen.set_pen_size(5)
     pen.set_pen_color(LEVEL_COLOR)
     pen.pen_up()
@@ -104,13 +165,6 @@ def level2(x: int, y: int, pen: ScratchPen, move: int) -> None:
     pen.goto(-50 + x, 5 + y)
     pen.goto(-30 + x, 5 + y)
     pen.pen_up()
-    pen.goto(240 + (sin(radians(move)) * 200) + x, -15 + y)
-    pen.pen_down()
-    pen.goto(300 + (sin(radians(move)) * 200) + x, -15 + y)
-    pen.goto(300 + (sin(radians(move)) * 200) + x, -30 + y)
-    pen.goto(240 + (sin(radians(move)) * 200) + x, -30 + y)
-    pen.goto(240 + (sin(radians(move)) * 200) + x, -15 + y)
-    pen.pen_up()
     pen.goto(300 + x, -15 + y)
     pen.pen_down()
     pen.goto(310 + x, -15 + y)
@@ -125,21 +179,12 @@ def level2(x: int, y: int, pen: ScratchPen, move: int) -> None:
     pen.goto(600 + x, 30 + y)
     pen.goto(600 + x, -15 + y)
     pen.pen_up()
-    pen.goto(1000 + x, 255 + (sin(radians(move)) * -300) + y)
-    pen.pen_down()
-    pen.goto(1300 + x, 255 + (sin(radians(move)) * -300) + y)
-    pen.goto(1300 + x, 300 + (sin(radians(move)) * -300) + y)
-    pen.goto(1000 + x, 300 + (sin(radians(move)) * -300) + y)
-    pen.goto(1000 + x, 255 + (sin(radians(move)) * -300) + y)
-    pen.pen_up()
     pen.goto(1600 + x, 600 + y)
     pen.pen_down()
     pen.goto(1300 + x, 600 + y)
     pen.goto(1300 + x, 500 + y)
     pen.goto(1600 + x, 500 + y)
     pen.goto(1600 + x, 600 + y)
-    for i in range(0, 301, 3):
-        pen.goto(1600 + x + i, 600 + (sin(radians(i + move * 10)) * 20) - sin(radians(move * 10)) * 20 + y)
     pen.pen_up()
     pen.goto(1900 + x, 620 + y)
     pen.pen_down()
@@ -147,14 +192,38 @@ def level2(x: int, y: int, pen: ScratchPen, move: int) -> None:
     pen.goto(2100 + x, 580 + y)
     pen.goto(1900 + x, 580 + y)
     pen.goto(1900 + x, 620 + y)
+    pen.pen_up()
+
+# Parts of level 2 that depend on move. Every overlap between these and the
+# static part is level-colored, so drawing them after it changes nothing.
+def level2_moving(x: int, y: int, pen: ScratchPen, move: float) -> None:
+    pen.set_pen_size(5)
+    pen.set_pen_color(LEVEL_COLOR)
+    pen.pen_up()
+    pen.goto(240 + (sin(radians(move)) * 200) + x, -15 + y)
+    pen.pen_down()
+    pen.goto(300 + (sin(radians(move)) * 200) + x, -15 + y)
+    pen.goto(300 + (sin(radians(move)) * 200) + x, -30 + y)
+    pen.goto(240 + (sin(radians(move)) * 200) + x, -30 + y)
+    pen.goto(240 + (sin(radians(move)) * 200) + x, -15 + y)
+    pen.pen_up()
+    pen.goto(1000 + x, 255 + (sin(radians(move)) * -300) + y)
+    pen.pen_down()
+    pen.goto(1300 + x, 255 + (sin(radians(move)) * -300) + y)
+    pen.goto(1300 + x, 300 + (sin(radians(move)) * -300) + y)
+    pen.goto(1000 + x, 300 + (sin(radians(move)) * -300) + y)
+    pen.goto(1000 + x, 255 + (sin(radians(move)) * -300) + y)
+    pen.pen_up()
+    pen.goto(1600 + x, 600 + y)
+    pen.pen_down()
+    pen.polyline([(1600 + x + i, 600 + (sin(radians(i + move * 10)) * 20) - sin(radians(move * 10)) * 20 + y)
+                  for i in range(0, 301, 3)])
     pen.set_pen_color(GOAL_COLOR)
     pen.pen_up()
     pen.goto(2200 + x, 620 + sin(radians(move * 6)) * 100 + y)
     pen.pen_down()
     pen.goto(2200 + x, 695 + sin(radians(move * 6)) * 100 + y)
 
-    
-
 def level3(x: int, y: int, pen: ScratchPen) -> None:
     pass
 
@@ -174,4 +243,19 @@ def level8(x: int, y: int, pen: ScratchPen) -> None:
     pass
 
 def the_other_level(x: int, y: int, pen: ScratchPen) -> None:
-    pass
\ No newline at end of file
+    pass
+
+
+# Level functions by number, as (static part, moving part or None).
+# The static part draws in level space offset by (x, y); the moving part
+# also takes the level's internal move counter.
+LEVELS = {
+    1: (level1, None),
+    2: (level2, level2_moving),
+    3: (level3, None),
+    4: (level4, None),
+    5: (level5, None),
+    6: (level6, None),
+    7: (level7, None),
+    8: (level8, None),
+}
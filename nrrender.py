@@ -0,0 +1,291 @@
+import os
+import json
+import hashlib
+import pygame
+from collections import OrderedDict
+from nrutil import *
+from nrconstants import *
+
+
+## Presentation
+def present_frame(display, buffer):
+    """
+    Puts the finished frame in buffer on the display surface.
+
+    At matching sizes this is one blit. Otherwise buffer is scaled once,
+    straight into the display surface, so no intermediate surface is
+    allocated per frame.
+    """
+    if buffer.get_size() == display.get_size():
+        display.blit(buffer, (0, 0))
+    else:
+        pygame.transform.scale(buffer, display.get_size(), display)
+
+
+## LevelTileCache class
+class LevelTileCache:
+    """
+    LRU cache of pre-rendered static level geometry.
+
+    Levels are cut into square world-space tiles of tile_size Scratch units,
+    rendered on demand at SCALE_FACTOR. Each frame blits the few tiles that
+    overlap the stage instead of re-drawing every stroke. Tiles are evicted
+    least-recently-used once their pixel memory exceeds budget_mb.
+    """
+
+    def __init__(self, tile_size=LEVEL_TILE_SIZE, budget_mb=LEVEL_TILE_BUDGET_MB):
+        self.tile_size = tile_size
+        self.tile_pixels = tile_size * SCALE_FACTOR
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.tiles = OrderedDict()  # (level, tile_x, tile_y) -> Surface
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _render_tile(self, compiled, tile_x, tile_y):
+        left = tile_x * self.tile_size
+        top = (tile_y + 1) * self.tile_size  # Scratch y grows upwards
+        indices = compiled.spatial_hash.query(left, top - self.tile_size, left + self.tile_size, top)
+        if not indices:
+            # Empty tiles are cached as None and cost no pixel memory
+            return None
+        surface = pygame.Surface((self.tile_pixels, self.tile_pixels))
+        surface.fill(BACKGROUND_COLOR)
+        # Background pixels stay transparent so the debug grid shows through
+        surface.set_colorkey(BACKGROUND_COLOR)
+        for index in indices:
+            start_x, start_y, end_x, end_y, size, color, _ = compiled.static_segments[index]
+            draw_rounded_line(
+                surface,
+                color,
+                ((start_x - left) * SCALE_FACTOR, (top - start_y) * SCALE_FACTOR),
+                ((end_x - left) * SCALE_FACTOR, (top - end_y) * SCALE_FACTOR),
+                size,
+            )
+        return surface
+
+    def get_tile(self, level, compiled, tile_x, tile_y):
+        key = (level, tile_x, tile_y)
+        if key in self.tiles:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        self.misses += 1
+        surface = self._render_tile(compiled, tile_x, tile_y)
+        self.tiles[key] = surface
+        self.bytes_used += self._tile_bytes(surface)
+        # Never evict the tile just rendered, even on a tiny budget
+        while self.bytes_used > self.budget_bytes and len(self.tiles) > 1:
+            _, evicted = self.tiles.popitem(last=False)
+            self.bytes_used -= self._tile_bytes(evicted)
+            self.evictions += 1
+        return surface
+
+    def _tile_bytes(self, surface):
+        if surface is None:
+            return 0
+        return surface.get_bytesize() * self.tile_pixels * self.tile_pixels
+
+    def draw(self, surface, level, compiled, x, y):
+        # The stage in level space is [-240 - x, 240 - x] x [-180 - y, 180 - y]
+        size = self.tile_size
+        for tile_x in range(int((-240 - x) // size), int((240 - x) // size) + 1):
+            for tile_y in range(int((-180 - y) // size), int((180 - y) // size) + 1):
+                tile = self.get_tile(level, compiled, tile_x, tile_y)
+                if tile is None:
+                    continue
+                screen_x, screen_y = scratch_to_pygame_coordinates(tile_x * size + x, (tile_y + 1) * size + y)
+                surface.blit(tile, (round(screen_x), round(screen_y)))
+
+    def clear(self):
+        self.tiles.clear()
+        self.bytes_used = 0
+
+
+level_tiles = LevelTileCache()
+
+
+## ScrollingLevelLayer class
+class ScrollingLevelLayer:
+    """
+    Static level geometry kept on a persistent stage-sized layer.
+
+    When the camera moves by a whole number of pixels, the previous layer is
+    shifted with Surface.scroll and only the newly exposed strips are
+    redrawn. Any other move (fractional pixels, a large jump, another level)
+    redraws the whole layer. Pixels drawn at the new offset then match a full
+    redraw exactly, because pygame's rasterization is invariant under
+    whole-pixel translation.
+    """
+
+    def __init__(self):
+        self.layer = pygame.Surface((RENDER_WIDTH, RENDER_HEIGHT))
+        self.level = None
+        self.offset = None
+        self.full_redraws = 0
+        self.scrolls = 0
+        self.reuses = 0
+
+    def _draw_region(self, compiled, x, y, rect):
+        # Redraws every static segment that can reach rect (pygame pixels)
+        self.layer.fill(BACKGROUND_COLOR, rect)
+        self.layer.set_clip(rect)
+        left, top = pygame_to_scratch_coordinates(rect.left, rect.top)
+        right, bottom = pygame_to_scratch_coordinates(rect.right, rect.bottom)
+        for index in compiled.spatial_hash.query(left - x, bottom - y, right - x, top - y):
+            start_x, start_y, end_x, end_y, size, color, _ = compiled.static_segments[index]
+            draw_rounded_line(
+                self.layer,
+                color,
+                scratch_to_pygame_coordinates(start_x + x, start_y + y),
+                scratch_to_pygame_coordinates(end_x + x, end_y + y),
+                size,
+            )
+        self.layer.set_clip(None)
+
+    # With opaque=True the layer replaces surface outright, which is much
+    # cheaper than a colorkey blit but only correct on a freshly erased surface
+    def draw(self, surface, level, compiled, x, y, opaque=False):
+        full_rect = self.layer.get_rect()
+        if self.level == level and self.offset is not None:
+            shift_x = (x - self.offset[0]) * SCALE_FACTOR
+            shift_y = (self.offset[1] - y) * SCALE_FACTOR
+        else:
+            shift_x = shift_y = None
+        if shift_x == 0 and shift_y == 0:
+            self.reuses += 1
+        elif (shift_x is not None and float(shift_x).is_integer() and float(shift_y).is_integer()
+                and abs(shift_x) < full_rect.width and abs(shift_y) < full_rect.height):
+            shift_x = int(shift_x)
+            shift_y = int(shift_y)
+            self.layer.scroll(shift_x, shift_y)
+            # Strips uncovered by the scroll: a column on one side, a row on the other
+            if shift_x > 0:
+                self._draw_region(compiled, x, y, pygame.Rect(0, 0, shift_x, full_rect.height))
+            elif shift_x < 0:
+                self._draw_region(compiled, x, y, pygame.Rect(full_rect.width + shift_x, 0, -shift_x, full_rect.height))
+            if shift_y > 0:
+                self._draw_region(compiled, x, y, pygame.Rect(0, 0, full_rect.width, shift_y))
+            elif shift_y < 0:
+                self._draw_region(compiled, x, y, pygame.Rect(0, full_rect.height + shift_y, full_rect.width, -shift_y))
+            self.scrolls += 1
+        else:
+            self._draw_region(compiled, x, y, full_rect)
+            self.full_redraws += 1
+        self.level = level
+        self.offset = (x, y)
+        self.layer.set_colorkey(None if opaque else BACKGROUND_COLOR)
+        surface.blit(self.layer, (0, 0))
+
+    def invalidate(self):
+        self.level = None
+        self.offset = None
+
+
+level_scroll_layer = ScrollingLevelLayer()
+
+
+## ScreenCache class
+class ScreenCache:
+    """
+    Finished frames of static screens, keyed by a screen id and the inputs
+    that shape the screen (such as the username on the menu).
+
+    save() keeps a copy of the pen's surface and the pen state it was left
+    in; restore() puts both back, so a screen seen before costs one blit.
+    With a directory, frames are also written there as PNGs (with the pen
+    state alongside as JSON) and survive restarts. Collision state is not
+    kept: static screens never test it, and the game screen starts from
+    erase_all().
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.frames = {}  # (screen_id, key) -> (Surface, pen state)
+        self.hits = 0
+        self.misses = 0
+
+    def _file_stem(self, screen_id, key):
+        # Anything that changes the pixels belongs in the name
+        digest = hashlib.sha1(repr((SCREEN_CACHE_VERSION, RENDER_WIDTH, RENDER_HEIGHT, SCALE_FACTOR, key))
+                              .encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{screen_id}-{digest}")
+
+    def _pen_state(self, pen):
+        return [pen.x, pen.y, pen.direction, pen.pen_down_status, pen.pen_size,
+                list(pen.pen_color), pen.pen_shade]
+
+    def _load(self, screen_id, key):
+        if self.directory is None:
+            return None
+        stem = self._file_stem(screen_id, key)
+        try:
+            with open(stem + ".json", "r", encoding="utf-8") as state_file:
+                pen_state = json.load(state_file)
+            surface = pygame.image.load(stem + ".png")
+        except (OSError, ValueError, pygame.error):
+            return None
+        if surface.get_size() != (RENDER_WIDTH, RENDER_HEIGHT):
+            return None
+        return surface, pen_state
+
+    def _write(self, screen_id, key, surface, pen_state):
+        stem = self._file_stem(screen_id, key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # The PNG goes last: a frame only counts once both files exist
+            with open(stem + ".json", "w", encoding="utf-8") as state_file:
+                json.dump(pen_state, state_file)
+            pygame.image.save(surface, stem + ".tmp.png")
+            os.replace(stem + ".tmp.png", stem + ".png")
+        except (OSError, pygame.error) as error:
+            print(f"WARN: Could not write the screen cache: {error}")
+            self.directory = None
+
+    def restore(self, pen, screen_id, key):
+        # Returns False, touching nothing, when the screen has not been saved
+        frame = self.frames.get((screen_id, key))
+        if frame is None:
+            frame = self._load(screen_id, key)
+            if frame is None:
+                self.misses += 1
+                return False
+            self.frames[(screen_id, key)] = frame
+        self.hits += 1
+        surface, pen_state = frame
+        pen.erase_all()
+        pen.surface.blit(surface, (0, 0))
+        pen.blank = False
+        x, y, direction, pen_down_status, pen_size, pen_color, pen_shade = pen_state
+        pen.x, pen.y = x, y
+        pen.last_pos = (x, y)
+        pen.direction = direction
+        pen.pen_down_status = pen_down_status
+        pen.pen_size = pen_size
+        pen.pen_color = pygame.Color(*pen_color)
+        pen.pen_shade = pen_shade
+        return True
+
+    def save(self, pen, screen_id, key):
+        surface = pen.surface.copy()
+        pen_state = self._pen_state(pen)
+        self.frames[(screen_id, key)] = (surface, pen_state)
+        if self.directory is not None:
+            self._write(screen_id, key, surface, pen_state)
+
+    def invalidate(self, screen_id=None):
+        # Forgets one screen (every key), or all of them, in memory and on disk
+        for frame_id in [frame_id for frame_id in self.frames if screen_id in (None, frame_id[0])]:
+            del self.frames[frame_id]
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if screen_id is None or name.startswith(f"{screen_id}-"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+screen_cache = ScreenCache(get_user_cache_dir() if SCREEN_CACHE_ON_DISK else None)
@@ -1,6 +1,7 @@
 import pygame
 import os
 import sys
+import math
 import subprocess
 from nrconstants import *
 
@@ -44,21 +45,71 @@ def show_system_message_box(title, message):
     print(f"{title}: {message}")
     return False
 
+# Per-user directory for caches that may be deleted at any time
+def get_user_cache_dir():
+    if sys.platform == "darwin":
+        return os.path.join(os.path.expanduser("~"), "Library", "Caches", "NeonRide")
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+        return os.path.join(base, "NeonRide", "Cache")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "neonride")
+
+# The login name never changes while the game runs, so it is looked up once
+_username = None
+
+def get_username():
+    global _username
+    if _username is None:
+        _username = os.getlogin()
+    return _username
+
 # Function to convert Scratch coordinates (center is 0,0) to Pygame coordinates (top-left is 0,0)
 def scratch_to_pygame_coordinates(x, y):
     scaled_x = x * SCALE_FACTOR
     scaled_y = y * SCALE_FACTOR
-    pygame_x = scaled_x + (NATIVE_WIDTH // 2)
-    pygame_y = (NATIVE_HEIGHT // 2) - scaled_y
+    pygame_x = scaled_x + (RENDER_WIDTH // 2)
+    pygame_y = (RENDER_HEIGHT // 2) - scaled_y
     return pygame_x, pygame_y
 
 # Function to convert Pygame coordinates (top-left is 0,0) to Scratch coordinates (center is 0,0)
 def pygame_to_scratch_coordinates(pygame_x, pygame_y):
     # Convert Pygame coordinates (top-left origin) to Scratch coordinates (center origin)
-    scaled_x = (pygame_x - (NATIVE_WIDTH // 2)) / SCALE_FACTOR
-    scaled_y = ((NATIVE_HEIGHT // 2) - pygame_y) / SCALE_FACTOR
+    scaled_x = (pygame_x - (RENDER_WIDTH // 2)) / SCALE_FACTOR
+    scaled_y = ((RENDER_HEIGHT // 2) - pygame_y) / SCALE_FACTOR
     return scaled_x, scaled_y
 
+# Function to convert window coordinates (such as mouse positions) to Scratch coordinates.
+# The window is NATIVE_WIDTH x NATIVE_HEIGHT whatever the render resolution is.
+def display_to_scratch_coordinates(display_x, display_y):
+    return pygame_to_scratch_coordinates(display_x * RENDER_WIDTH / NATIVE_WIDTH,
+                                         display_y * RENDER_HEIGHT / NATIVE_HEIGHT)
+
+# Vector2 compares coordinates with this tolerance
+_VECTOR_EPSILON = 1e-6
+
+# Corner buffer shared by every quad drawn; pygame copies the points
+_quad = [(0.0, 0.0)] * 4
+
+def _draw_segment_quad(surface, color, x1, y1, x2, y2, thickness):
+    # Fills the body of a segment, thickness pixels wide. Uses the same float
+    # operations as Vector2(-lv.y, lv.x) * thickness // 2 on the normalized
+    # direction lv, without building any vectors. Returns False, drawing
+    # nothing, when the end points are equal as Vector2s.
+    dx = x2 - x1
+    dy = y2 - y1
+    if abs(dx) < _VECTOR_EPSILON and abs(dy) < _VECTOR_EPSILON:
+        return False
+    length = math.sqrt(dx * dx + dy * dy)
+    nx = -(dy / length) * thickness // 2
+    ny = (dx / length) * thickness // 2
+    _quad[0] = (x1 + nx, y1 + ny)
+    _quad[1] = (x2 + nx, y2 + ny)
+    _quad[2] = (x2 - nx, y2 - ny)
+    _quad[3] = (x1 - nx, y1 - ny)
+    pygame.draw.polygon(surface, color, _quad)
+    return True
+
 def draw_rounded_line(surface, color, start_pos, end_pos, thickness):
     """
     Draws a line with rounded ends.
@@ -72,21 +123,100 @@ def draw_rounded_line(surface, color, start_pos, end_pos, thickness):
     """
     # Calculate scaled thickness
     thickness = round(thickness * SCALE_FACTOR)
-    p1v = pygame.math.Vector2(start_pos)
-    p2v = pygame.math.Vector2(end_pos)
 
     # Avoid zero-length normalize crashes
-    if p1v == p2v:
+    if not _draw_segment_quad(surface, color, start_pos[0], start_pos[1], end_pos[0], end_pos[1], thickness):
         pygame.draw.circle(surface, color, start_pos, max(1, round(thickness / 2)))
         return
 
-    lv = (p2v - p1v).normalize()
-    lnv = pygame.math.Vector2(-lv.y, lv.x) * thickness // 2
-    pts = [p1v + lnv, p2v + lnv, p2v - lnv, p1v - lnv]
-    pygame.draw.polygon(surface, color, pts)
     pygame.draw.circle(surface, color, start_pos, round(thickness / 2))
     pygame.draw.circle(surface, color, end_pos, round(thickness / 2))
 
+def draw_rounded_polyline(surface, color, points, thickness):
+    """
+    Draws connected lines with rounded ends and joints.
+
+    Looks the same as draw_rounded_line on each consecutive pair of points,
+    but the cap shared by two segments is only drawn once.
+
+    Args:
+        surface: The Pygame surface to draw on.
+        color: The color of the lines.
+        points: The positions to connect, in order (x, y).
+        thickness: The thickness of the lines.
+    """
+    if not points:
+        return
+    thickness = round(thickness * SCALE_FACTOR)
+    radius = round(thickness / 2)
+    # Circles with a radius below 1 draw nothing, so thin lines only get the
+    # one-pixel dots of their zero-length segments
+    caps = list(points) if radius >= 1 else []
+    x1, y1 = points[0]
+    for x2, y2 in points[1:]:
+        if not _draw_segment_quad(surface, color, x1, y1, x2, y2, thickness) and radius < 1:
+            pygame.draw.circle(surface, color, (x1, y1), 1)
+        x1, y1 = x2, y2
+    for point in caps:
+        pygame.draw.circle(surface, color, point, radius)
+
+class SpatialHash:
+    """
+    Uniform grid hash of integer items by bounding box.
+
+    Items are ids (such as segment indices) inserted with their bounding box.
+    query() returns the ids whose boxes overlap a rectangle in ascending
+    order, visiting only the cells the rectangle covers. Counters record how
+    much work the queries did.
+    """
+
+    def __init__(self, cell_size=SPATIAL_HASH_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.boxes = {}
+        self.queries = 0
+        self.items_returned = 0
+        self.cells_visited = 0
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def insert(self, item, min_x, min_y, max_x, max_y):
+        self.boxes[item] = (min_x, min_y, max_x, max_y)
+        size = self.cell_size
+        for cell_x in range(int(min_x // size), int(max_x // size) + 1):
+            for cell_y in range(int(min_y // size), int(max_y // size) + 1):
+                self.cells.setdefault((cell_x, cell_y), []).append(item)
+
+    def query(self, min_x, min_y, max_x, max_y):
+        size = self.cell_size
+        boxes = self.boxes
+        found = set()
+        for cell_x in range(int(min_x // size), int(max_x // size) + 1):
+            for cell_y in range(int(min_y // size), int(max_y // size) + 1):
+                items = self.cells.get((cell_x, cell_y))
+                self.cells_visited += 1
+                if items is None:
+                    continue
+                for item in items:
+                    if item in found:
+                        continue
+                    box = boxes[item]
+                    if box[0] <= max_x and box[2] >= min_x and box[1] <= max_y and box[3] >= min_y:
+                        found.add(item)
+        self.queries += 1
+        self.items_returned += len(found)
+        return sorted(found)
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+
+    def reset_counters(self):
+        self.queries = 0
+        self.items_returned = 0
+        self.cells_visited = 0
+
 # Convert Scratch colour integer to hex code
 # This still does not work properly, any help would be appreciated
 def scratch_color_to_hex(color_value):
@@ -1,5 +1,15 @@
+import os
 import pygame
 import math
+import itertools
+import operator
+import hashlib
+import zipfile
+from collections import OrderedDict
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from nrutil import *
 from nrconstants import *
 
@@ -50,6 +60,20 @@ def _resolve_color_id(color_val):
     return COLOR_TO_ID.get(hex_str, COLOR_ID_AIR)
 
 
+# Color ids of the color strings passed to touching_color, which are
+# almost always the same few constants
+_touching_color_ids = {}
+
+
+def _touching_color_id(color_val):
+    if not isinstance(color_val, str):
+        return _resolve_color_id(color_val)
+    color_id = _touching_color_ids.get(color_val)
+    if color_id is None:
+        color_id = _touching_color_ids[color_val] = _resolve_color_id(color_val)
+    return color_id
+
+
 def scratch_to_grid(x, y):
     gx = int((x + COLOR_GRID_WIDTH / 2))
     gy = int((COLOR_GRID_HEIGHT / 2) - y - 1)
@@ -58,49 +82,1116 @@ def scratch_to_grid(x, y):
     return gx, gy
 
 
-def _blank_color_grid():
-    return [[COLOR_ID_AIR for _ in range(COLOR_GRID_WIDTH)] for _ in range(COLOR_GRID_HEIGHT)]
+class ColorGrid:
+    """
+    Flat, row-major grid of color ids backed by a single bytearray.
 
+    Cleared in place with slice assignment, so erasing the stage every frame
+    does not allocate a fresh list of lists.
 
-color_grid = _blank_color_grid()
+    Every write that changes a cell bumps generation, so callers can tell
+    whether a query result they kept is still current.
 
+    Rectangle queries scan rows until enough of them have met the same
+    generation, then use a summed-area table per color id: four lookups a
+    query until the next write. The grid is redrawn every frame and a frame
+    queries it only a few times, so in play the tables are rarely built.
+    """
 
-def reset_color_grid():
-    global color_grid
-    color_grid = _blank_color_grid()
+    def __init__(self, width=COLOR_GRID_WIDTH, height=COLOR_GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        self.generation = 0
+        self.cells = bytearray(width * height)
+        # One full row per color id; slices of these feed fill_span without copying
+        self._span_sources = [memoryview(bytes([color_id]) * width) for color_id in range(COLOR_ID_LAVA + 1)]
+        self._blank = bytes(width * height)
+        # translate() tables mapping a color id's cells to 1 and all others to 0
+        self._color_masks = [bytes(int(cell == color_id) for cell in range(256))
+                             for color_id in range(COLOR_ID_LAVA + 1)]
+        self._init_area_tables(GRID_AREA_TABLE_QUERIES["python"])
 
+    def _init_area_tables(self, table_queries):
+        # _areas[color_id] is the (height + 1) x (width + 1) integral image of
+        # that color as of generation _area_generations[color_id]; _scans
+        # counts the queries per color id that scanned _scan_generation
+        self.table_queries = table_queries
+        self._areas = [None] * (COLOR_ID_LAVA + 1)
+        self._area_generations = [-1] * (COLOR_ID_LAVA + 1)
+        self._scans = [0] * (COLOR_ID_LAVA + 1)
+        self._scan_generation = -1
 
-def _write_disc_to_grid(center_x, center_y, radius, color_id):
-    if color_id is None:
-        return
-    gx_center, gy_center = scratch_to_grid(center_x, center_y)
-    if gx_center is None:
-        return
-    radius_int = max(1, int(math.ceil(radius)))
-    for oy in range(-radius_int, radius_int + 1):
-        for ox in range(-radius_int, radius_int + 1):
-            if ox * ox + oy * oy > radius_int * radius_int:
+    def get(self, gx, gy):
+        return self.cells[gy * self.width + gx]
+
+    def fill_span(self, gy, gx_start, gx_end, color_id):
+        # Writes color_id to cells [gx_start, gx_end) of row gy; a span that
+        # already holds it is left alone and does not start a new generation
+        base = gy * self.width
+        if self.cells.count(color_id, base + gx_start, base + gx_end) != gx_end - gx_start:
+            self.generation += 1
+            self.cells[base + gx_start:base + gx_end] = self._span_sources[color_id][gx_start:gx_end]
+
+    def span_contains(self, gy, gx_start, gx_end, color_id):
+        base = gy * self.width
+        return self.cells.find(color_id, base + gx_start, base + gx_end) != -1
+
+    def rect_contains(self, gx_start, gx_end, gy_start, gy_end, color_id):
+        if self._area_generations[color_id] != self.generation:
+            if self._scan_generation != self.generation:
+                self._scan_generation = self.generation
+                for other_id in range(COLOR_ID_LAVA + 1):
+                    self._scans[other_id] = 0
+            self._scans[color_id] += 1
+            if self._scans[color_id] < self.table_queries:
+                return self._scan_rect(gx_start, gx_end, gy_start, gy_end, color_id)
+            self._areas[color_id] = self._build_area(color_id)
+            self._area_generations[color_id] = self.generation
+        return self._area_contains(self._areas[color_id], gx_start, gx_end, gy_start, gy_end)
+
+    def _scan_rect(self, gx_start, gx_end, gy_start, gy_end, color_id):
+        for gy in range(gy_start, gy_end):
+            if self.span_contains(gy, gx_start, gx_end, color_id):
+                return True
+        return False
+
+    def _build_area(self, color_id):
+        # Row by row: each row's running count (accumulate) added to the row
+        # above (map), both looping in C
+        width = self.width
+        mask = self.cells.translate(self._color_masks[color_id])
+        row = [0] * (width + 1)
+        area = [row]
+        for base in range(0, width * self.height, width):
+            row = list(map(operator.add, row, itertools.accumulate(mask[base:base + width], initial=0)))
+            area.append(row)
+        return area
+
+    def _area_contains(self, area, gx_start, gx_end, gy_start, gy_end):
+        return (area[gy_end][gx_end] - area[gy_start][gx_end]
+                - area[gy_end][gx_start] + area[gy_start][gx_start]) > 0
+
+    def hitbox_touches(self, left, right, top, bottom, color_id):
+        # Hitbox cells sx in [left, right), sy in [top, bottom) map to grid
+        # columns sx + 240 and rows 179 - sy; clip that rectangle to the grid
+        gx_start = max(0, left + self.width // 2)
+        gx_end = min(self.width, right + self.width // 2)
+        gy_start = max(0, self.height // 2 - bottom)
+        gy_end = min(self.height, self.height // 2 - top)
+        if gx_start >= gx_end:
+            return False
+        return self.rect_contains(gx_start, gx_end, gy_start, gy_end, color_id)
+
+    def hitbox_clearance(self, left, right, spans, color_id):
+        # Counts the leading (top, bottom) spans of a hitbox fixed at
+        # [left, right) whose rectangle touches color_id. Successive spans of
+        # a rising hitbox overlap almost entirely, so each row is scanned
+        # at most once
+        gx_start = max(0, left + self.width // 2)
+        gx_end = min(self.width, right + self.width // 2)
+        if gx_start >= gx_end:
+            return 0
+        row_hits = {}
+        count = 0
+        for top, bottom in spans:
+            for gy in range(max(0, self.height // 2 - bottom), min(self.height, self.height // 2 - top)):
+                hit = row_hits.get(gy)
+                if hit is None:
+                    hit = row_hits[gy] = self.span_contains(gy, gx_start, gx_end, color_id)
+                if hit:
+                    break
+            else:
+                return count
+            count += 1
+        return count
+
+    def clear(self):
+        self.generation += 1
+        self.cells[:] = self._blank
+
+    def to_bytes(self):
+        return bytes(self.cells)
+
+    def write_disc(self, center_x, center_y, radius, color_id):
+        gx_center, gy_center = scratch_to_grid(center_x, center_y)
+        if gx_center is None:
+            return
+        self._stamp_disc(gx_center, gy_center, max(1, int(math.ceil(radius))), color_id)
+
+    def _stamp_disc(self, gx_center, gy_center, radius_int, color_id):
+        radius_sq = radius_int * radius_int
+        for oy in range(-radius_int, radius_int + 1):
+            gy = gy_center + oy
+            if gy < 0 or gy >= self.height:
                 continue
-            gx = gx_center + ox
+            # Widest |ox| with ox^2 + oy^2 <= r^2 on this row
+            half_width = math.isqrt(radius_sq - oy * oy)
+            gx_start = max(0, gx_center - half_width)
+            gx_end = min(self.width, gx_center + half_width + 1)
+            if gx_start < gx_end:
+                self.fill_span(gy, gx_start, gx_end, color_id)
+
+    def write_line(self, start_pos, end_pos, thickness, color_id):
+        self.write_polyline((start_pos, end_pos), thickness, color_id)
+
+    def write_polyline(self, points, thickness, color_id):
+        # Stamps a disc at two samples per unit of each segment's longer axis
+        radius_int = max(1, int(math.ceil(max(0.5, thickness / 2))))
+        last_center = None
+        for (sx, sy), (ex, ey) in zip(points, points[1:]):
+            dx = ex - sx
+            dy = ey - sy
+            steps = int(max(abs(dx), abs(dy), 1) * 2)
+            for i in range(steps + 1):
+                t = i / steps
+                center = scratch_to_grid(sx + dx * t, sy + dy * t)
+                # Neighbouring samples, and the shared end of one segment and
+                # start of the next, usually land on the same cell; restamping
+                # the same disc in the same color changes nothing
+                if center[0] is None or center == last_center:
+                    continue
+                last_center = center
+                self._stamp_disc(center[0], center[1], radius_int, color_id)
+
+
+class NumpyColorGrid(ColorGrid):
+    """
+    ColorGrid stored as a 2D uint8 NumPy array.
+
+    write_line rasterizes a whole stroke in one vectorized pass. It computes
+    the same disc centers as ColorGrid.write_line and stamps every disc at
+    once, so the resulting grid is bit-identical to the pure-Python engine.
+
+    Rectangles are scanned with one vectorized comparison until a color's
+    summed-area table pays off (see ColorGrid).
+    """
+
+    def __init__(self, width=COLOR_GRID_WIDTH, height=COLOR_GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        self.generation = 0
+        self.cells = numpy.zeros((height, width), dtype=numpy.uint8)
+        self._disc_offsets = {}
+        # _present[color_id] is False while the color has not been written
+        # since the last clear
+        self._present = [False] * (COLOR_ID_LAVA + 1)
+        self._present[COLOR_ID_AIR] = True
+        self._init_area_tables(GRID_AREA_TABLE_QUERIES["numpy"])
+
+    def get(self, gx, gy):
+        return int(self.cells[gy, gx])
+
+    def fill_span(self, gy, gx_start, gx_end, color_id):
+        span = self.cells[gy, gx_start:gx_end]
+        if (span != color_id).any():
+            self.generation += 1
+            self._present[color_id] = True
+            span[:] = color_id
+
+    def span_contains(self, gy, gx_start, gx_end, color_id):
+        return self.rect_contains(gx_start, gx_end, gy, gy + 1, color_id)
+
+    def rect_contains(self, gx_start, gx_end, gy_start, gy_end, color_id):
+        if not self._present[color_id] or gx_start >= gx_end or gy_start >= gy_end:
+            return False
+        return super().rect_contains(gx_start, gx_end, gy_start, gy_end, color_id)
+
+    def _scan_rect(self, gx_start, gx_end, gy_start, gy_end, color_id):
+        return bool((self.cells[gy_start:gy_end, gx_start:gx_end] == color_id).any())
+
+    def _build_area(self, color_id):
+        area = numpy.zeros((self.height + 1, self.width + 1), dtype=numpy.int32)
+        numpy.cumsum(self.cells == color_id, axis=0, out=area[1:, 1:])
+        numpy.cumsum(area[1:, 1:], axis=1, out=area[1:, 1:])
+        return area
+
+    def _area_contains(self, area, gx_start, gx_end, gy_start, gy_end):
+        return bool((area[gy_end, gx_end] - area[gy_start, gx_end]
+                     - area[gy_end, gx_start] + area[gy_start, gx_start]) > 0)
+
+    def clear(self):
+        self.generation += 1
+        self.cells.fill(COLOR_ID_AIR)
+        for color_id in range(COLOR_ID_LAVA + 1):
+            self._present[color_id] = False
+        self._present[COLOR_ID_AIR] = True
+
+    def to_bytes(self):
+        return self.cells.tobytes()
+
+    def _offsets_for_radius(self, radius_int):
+        offsets = self._disc_offsets.get(radius_int)
+        if offsets is None:
+            span = numpy.arange(-radius_int, radius_int + 1)
+            oy, ox = numpy.meshgrid(span, span, indexing="ij")
+            inside = ox * ox + oy * oy <= radius_int * radius_int
+            offsets = (oy[inside], ox[inside])
+            self._disc_offsets[radius_int] = offsets
+        return offsets
+
+    def write_line(self, start_pos, end_pos, thickness, color_id):
+        sx, sy = start_pos
+        ex, ey = end_pos
+        dx = ex - sx
+        dy = ey - sy
+        steps = int(max(abs(dx), abs(dy), 1) * 2)
+        radius_int = max(1, int(math.ceil(max(0.5, thickness / 2))))
+
+        # Same float operations as scratch_to_grid, applied to every sample
+        t = numpy.arange(steps + 1) / steps
+        gx = numpy.trunc((sx + dx * t) + COLOR_GRID_WIDTH / 2).astype(numpy.int64)
+        gy = numpy.trunc((COLOR_GRID_HEIGHT / 2) - (sy + dy * t) - 1).astype(numpy.int64)
+        on_grid = (gx >= 0) & (gy >= 0) & (gx < self.width) & (gy < self.height)
+        if not on_grid.any():
+            return
+        centers = numpy.unique(gy[on_grid] * self.width + gx[on_grid])
+        center_y, center_x = numpy.divmod(centers, self.width)
+
+        offset_y, offset_x = self._offsets_for_radius(radius_int)
+        cell_y = (center_y[:, None] + offset_y[None, :]).ravel()
+        cell_x = (center_x[:, None] + offset_x[None, :]).ravel()
+        inside = (cell_x >= 0) & (cell_y >= 0) & (cell_x < self.width) & (cell_y < self.height)
+        cell_y = cell_y[inside]
+        cell_x = cell_x[inside]
+        if (self.cells[cell_y, cell_x] != color_id).any():
+            self.generation += 1
+            self._present[color_id] = True
+            self.cells[cell_y, cell_x] = color_id
+
+    def write_polyline(self, points, thickness, color_id):
+        # Each segment is already one vectorized pass
+        for start_pos, end_pos in zip(points, points[1:]):
+            self.write_line(start_pos, end_pos, thickness, color_id)
+
+
+class BitsetColorGrid(ColorGrid):
+    """
+    ColorGrid stored as one arbitrary-precision int bitset per row and color.
+
+    Bit gx of rows[color_id][gy] is set when cell (gx, gy) holds color_id.
+    Air is not stored; it is whatever no tracked color covers. Discs are
+    written by OR-ing precomputed row masks, and a hitbox query is one
+    shift-and-mask per hitbox row. Pure Python, so it works in the frozen
+    macOS app, which excludes NumPy.
+    """
+
+    def __init__(self, width=COLOR_GRID_WIDTH, height=COLOR_GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        self.generation = 0
+        self.row_mask = (1 << width) - 1
+        self._blank_rows = [0] * height
+        self.rows = [list(self._blank_rows) for _ in range(COLOR_ID_LAVA + 1)]
+        self._disc_masks = {}
+
+    def _span_mask(self, gx_start, gx_end):
+        return ((1 << (gx_end - gx_start)) - 1) << gx_start
+
+    def _or_row(self, gy, mask, color_id):
+        # Sets the masked cells to color_id and removes them from every other color
+        for other_id in range(COLOR_ID_LEVEL, COLOR_ID_LAVA + 1):
+            rows = self.rows[other_id]
+            if other_id == color_id:
+                if rows[gy] & mask != mask:
+                    rows[gy] |= mask
+                    self.generation += 1
+            elif rows[gy] & mask:
+                rows[gy] &= ~mask
+                self.generation += 1
+
+    def get(self, gx, gy):
+        for color_id in range(COLOR_ID_LEVEL, COLOR_ID_LAVA + 1):
+            if (self.rows[color_id][gy] >> gx) & 1:
+                return color_id
+        return COLOR_ID_AIR
+
+    def fill_span(self, gy, gx_start, gx_end, color_id):
+        self._or_row(gy, self._span_mask(gx_start, gx_end), color_id)
+
+    def span_contains(self, gy, gx_start, gx_end, color_id):
+        return self.rect_contains(gx_start, gx_end, gy, gy + 1, color_id)
+
+    def rect_contains(self, gx_start, gx_end, gy_start, gy_end, color_id):
+        if gx_start >= gx_end:
+            return False
+        mask = self._span_mask(gx_start, gx_end)
+        if color_id == COLOR_ID_AIR:
+            level_rows, goal_rows, lava_rows = self.rows[COLOR_ID_LEVEL:COLOR_ID_LAVA + 1]
+            for gy in range(gy_start, gy_end):
+                if (level_rows[gy] | goal_rows[gy] | lava_rows[gy]) & mask != mask:
+                    return True
+            return False
+        rows = self.rows[color_id]
+        for gy in range(gy_start, gy_end):
+            if rows[gy] & mask:
+                return True
+        return False
+
+    def clear(self):
+        self.generation += 1
+        for rows in self.rows:
+            rows[:] = self._blank_rows
+
+    def to_bytes(self):
+        cells = bytearray(self.width * self.height)
+        for color_id in range(COLOR_ID_LEVEL, COLOR_ID_LAVA + 1):
+            for gy, row in enumerate(self.rows[color_id]):
+                base = gy * self.width
+                while row:
+                    low_bit = row & -row
+                    cells[base + low_bit.bit_length() - 1] = color_id
+                    row ^= low_bit
+        return bytes(cells)
+
+    def _masks_for_radius(self, radius_int):
+        # (oy, half_width, mask) per disc row, with the mask anchored at bit 0
+        masks = self._disc_masks.get(radius_int)
+        if masks is None:
+            radius_sq = radius_int * radius_int
+            masks = []
+            for oy in range(-radius_int, radius_int + 1):
+                half_width = math.isqrt(radius_sq - oy * oy)
+                masks.append((oy, half_width, (1 << (2 * half_width + 1)) - 1))
+            self._disc_masks[radius_int] = masks
+        return masks
+
+    def write_disc(self, center_x, center_y, radius, color_id):
+        gx_center, gy_center = scratch_to_grid(center_x, center_y)
+        if gx_center is None:
+            return
+        self._stamp_disc(gx_center, gy_center, max(1, int(math.ceil(radius))), color_id)
+
+    def _stamp_disc(self, gx_center, gy_center, radius_int, color_id):
+        for oy, half_width, mask in self._masks_for_radius(radius_int):
             gy = gy_center + oy
-            if 0 <= gx < COLOR_GRID_WIDTH and 0 <= gy < COLOR_GRID_HEIGHT:
-                color_grid[gy][gx] = color_id
+            if gy < 0 or gy >= self.height:
+                continue
+            shift = gx_center - half_width
+            mask = (mask << shift if shift >= 0 else mask >> -shift) & self.row_mask
+            self._or_row(gy, mask, color_id)
+
+
+def make_color_grid(engine=GRID_ENGINE):
+    # Falls back to the pure-Python grid when NumPy is not bundled
+    if engine == "bitset":
+        return BitsetColorGrid()
+    if engine == "numpy":
+        if numpy is not None:
+            return NumpyColorGrid()
+        print("WARN: NumPy is not available, using the pure-Python grid engine.")
+    elif engine != "python":
+        print(f"WARN: Unknown grid engine '{engine}', using the pure-Python grid engine.")
+    return ColorGrid()
+
+
+class CapsuleWorld:
+    """
+    Analytic collision backend: the frame's strokes kept as capsules.
+
+    Every stroke is stored in stage space as a segment with the integer
+    radius the grid would stamp. A hitbox query tests
+    the hitbox rectangle against each candidate capsule directly, so nothing is
+    rasterized. Candidates come from a spatial hash over the frame's strokes,
+    plus the level's own spatial hash for its static geometry (see
+    set_static_layer), which therefore never has to be re-inserted.
+
+    Later strokes win where capsules of different colors overlap the hitbox,
+    as they do on the grid; those queries fall back to painting the cells
+    each capsule covers on the hitbox's rows, in draw order. Strokes in
+    untracked colors (the character, text, debug grid) are stored as air
+    where they may cover a tracked stroke, since on the grid they
+    overwrite the cells they cover; air drawn over air is dropped.
+    """
+
+    BUCKET_SIZE = 32
+
+    def __init__(self):
+        # Capsules are (start_x, start_y, end_x, end_y, radius, color_id, draw order)
+        self.capsules = []
+        self.index = SpatialHash(self.BUCKET_SIZE)
+        self.static_index = None
+        self.static_capsules = None
+        self.static_offset = (0, 0)
+        # Draw order of the next stroke; static capsules take the orders
+        # from static_order_base - len(static_capsules) up to static_order_base - 1
+        self.next_order = 0
+        self.static_order_base = 0
+        # Whether a stroke in a tracked color has been stored since the last clear
+        self.has_tracked = False
+        # Bumped by every change that can change a query's answer
+        self.generation = 0
+
+    def clear(self):
+        self.generation += 1
+        self.capsules.clear()
+        self.index.clear()
+        self.next_order = 0
+        self.static_order_base = 0
+        self.has_tracked = False
+        self.static_index = None
+        self.static_capsules = None
+
+    def set_static_layer(self, static_index, static_capsules, offset_x, offset_y):
+        # static_capsules are in level space, indexed like static_index's items,
+        # with draw orders from -len(static_capsules) to -1; the layer sits
+        # where the level is drawn, above earlier strokes (the debug grid)
+        # and below later ones
+        self.generation += 1
+        self.static_index = static_index
+        self.static_capsules = static_capsules
+        self.static_offset = (offset_x, offset_y)
+        self.next_order += len(static_capsules)
+        self.static_order_base = self.next_order
+
+    def write_line(self, start_pos, end_pos, thickness, color_id):
+        sx, sy = start_pos
+        ex, ey = end_pos
+        radius = max(1, int(math.ceil(max(0.5, thickness / 2))))
+        min_x = min(sx, ex) - radius
+        max_x = max(sx, ex) + radius
+        min_y = min(sy, ey) - radius
+        max_y = max(sy, ey) + radius
+        # Same reach as the grid, which only exists on the stage
+        if max_x < -COLOR_GRID_WIDTH / 2 or min_x > COLOR_GRID_WIDTH / 2 \
+                or max_y < -COLOR_GRID_HEIGHT / 2 or min_y > COLOR_GRID_HEIGHT / 2:
+            return
+        if color_id == COLOR_ID_AIR and not self._covers_tracked(min_x, min_y, max_x, max_y):
+            # Air drawn over air changes no answer
+            return
+        self.generation += 1
+        self.has_tracked = self.has_tracked or color_id != COLOR_ID_AIR
+        self.index.insert(len(self.capsules), min_x, min_y, max_x, max_y)
+        self.capsules.append((sx, sy, ex, ey, radius, color_id, self.next_order))
+        self.next_order += 1
+
+    def _covers_tracked(self, min_x, min_y, max_x, max_y):
+        # Whether a box may overlap a stroke in a tracked color drawn so far
+        if self.has_tracked and any(self.capsules[item][5] != COLOR_ID_AIR for item in self.index.query(min_x, min_y, max_x, max_y)):
+            return True
+        if self.static_index is None:
+            return False
+        offset_x, offset_y = self.static_offset
+        return bool(self.static_index.query(min_x - offset_x, min_y - offset_y, max_x - offset_x, max_y - offset_y))
+
+    def write_polyline(self, points, thickness, color_id):
+        # One capsule per segment, so draw order stays per stroke
+        for start_pos, end_pos in zip(points, points[1:]):
+            self.write_line(start_pos, end_pos, thickness, color_id)
+
+    def hitbox_clearance(self, left, right, spans, color_id):
+        # Counts the leading (top, bottom) spans of a hitbox fixed at
+        # [left, right) whose rectangle touches color_id. Each capsule near
+        # the hitbox's column is reduced once to the rows it reaches there,
+        # so a span is settled by comparing row ranges; only rows where a
+        # later stroke of another color may cover the match are painted, once
+        # each, as _capsules_touch would
+        if color_id == COLOR_ID_AIR:
+            return sum(1 for _ in spans)
+        right -= 1
+        # Spans are taken in windows that double in size, so a short rise
+        # does not gather capsules all the way up to the last span
+        spans = iter(spans)
+        count = 0
+        window = 16
+        while True:
+            batch = list(itertools.islice(spans, window))
+            if not batch:
+                break
+            low = batch[0][0]
+            high = batch[-1][1] - 1
+            reaching = []
+            for capsule in self.candidates(left, right, low, high):
+                rows = _capsule_rows(capsule, left, right, low, high)
+                if rows is not None:
+                    reaching.append((capsule, rows))
+            cleared = self._rows_clearance(reaching, left, right, batch, color_id)
+            count += cleared
+            if cleared < len(batch):
+                break
+            window *= 2
+        return count
+
+    def _rows_clearance(self, reaching, left, right, spans, color_id):
+        # hitbox_clearance over (capsule, rows) pairs; right is inclusive
+        matching = [(capsule[6], rows) for capsule, rows in reaching if capsule[5] == color_id]
+        if not matching:
+            return 0
+        first_hit = min(order for order, _ in matching)
+        covering = [(capsule[6], rows) for capsule, rows in reaching
+                    if capsule[5] != color_id and capsule[6] > first_hit]
+        ordered = sorted(reaching, key=lambda pair: pair[0][6])
+        row_hits = {}
+        count = 0
+        for top, bottom in spans:
+            bottom -= 1
+            span_hit = min((order for order, (lowest, highest) in matching
+                            if top <= highest and bottom >= lowest), default=None)
+            if span_hit is None:
+                break
+            if any(order > span_hit and top <= highest and bottom >= lowest
+                   for order, (lowest, highest) in covering):
+                # Painted rows are shared by the overlapping spans around them
+                touching = False
+                for cell_y in range(top, bottom + 1):
+                    hit = row_hits.get(cell_y)
+                    if hit is None:
+                        capsules = [capsule for capsule, (lowest, highest) in ordered
+                                    if lowest <= cell_y <= highest]
+                        hit = row_hits[cell_y] = self._row_touches(capsules, cell_y, left, right, color_id)
+                    if hit:
+                        touching = True
+                        break
+                if not touching:
+                    break
+            count += 1
+        return count
+
+    def candidates(self, left, right, top, bottom):
+        found = [self.capsules[item] for item in self.index.query(left, top, right, bottom)]
+        if self.static_index is not None:
+            offset_x, offset_y = self.static_offset
+            for item in self.static_index.query(left - offset_x, top - offset_y,
+                                                right - offset_x, bottom - offset_y):
+                sx, sy, ex, ey, radius, color_id, order = self.static_capsules[item]
+                found.append((sx + offset_x, sy + offset_y, ex + offset_x, ey + offset_y,
+                              radius, color_id, order + self.static_order_base))
+        return found
+
+    def hitbox_touches(self, left, right, top, bottom, color_id):
+        if color_id == COLOR_ID_AIR:
+            # Air is everything no capsule covers; a hitbox is never fully covered
+            return True
+        # Hitbox cells are the integer points of [left, right - 1] x [top, bottom - 1]
+        right -= 1
+        bottom -= 1
+        return self._capsules_touch(self.candidates(left, right, top, bottom), left, right, top, bottom, color_id)
+
+    def _capsules_touch(self, capsules, left, right, top, bottom, color_id):
+        # Whether, with capsules drawn in order, any cell of the inclusive
+        # rectangle ends up in color_id
+        touching = []
+        for capsule in capsules:
+            sx, sy, ex, ey, radius = capsule[:5]
+            if _segment_rect_distance_sq(sx, sy, ex, ey, left, top, right, bottom) <= radius * radius:
+                touching.append(capsule)
+        first_hit = min((capsule[6] for capsule in touching if capsule[5] == color_id), default=None)
+        if first_hit is None:
+            return False
+        if all(capsule[5] == color_id or capsule[6] < first_hit for capsule in touching):
+            return True
+        # A later stroke in another color may cover every matching cell:
+        # paint each row's covered cells in draw order and look at the result
+        touching.sort(key=lambda capsule: capsule[6])
+        return any(self._row_touches(touching, cell_y, left, right, color_id)
+                   for cell_y in range(top, bottom + 1))
+
+    def _row_touches(self, capsules, cell_y, left, right, color_id):
+        # Whether, with capsules (sorted by draw order) painted over row
+        # cell_y, any cell of [left, right] ends up in color_id
+        row = [None] * (right - left + 1)
+        for capsule in capsules:
+            cells = _capsule_row_cells(capsule, cell_y, left, right)
+            if cells is not None:
+                first, last = cells
+                row[first - left:last - left + 1] = [capsule[5]] * (last - first + 1)
+        return color_id in row
+
+
+class LevelDistanceField:
+    """
+    Signed distance to the static strokes of one level, per color id,
+    sampled at the integer points of level space.
+
+    A cell holds floor(distance to the nearest capsule surface of its color)
+    clamped to [-band, band], negative inside a stroke. Only a band around
+    the strokes is stored; everything outside it is at least band away.
+    Cells are int8, so a whole level takes a few MB.
+    """
+
+    def __init__(self, fields, band):
+        self.fields = fields  # color_id -> (origin_x, origin_y, int8 array indexed [y, x])
+        self.band = band
+        # Flat int8 views: indexing them yields plain ints, far cheaper than NumPy scalars
+        self._lookup = {color_id: (origin_x, origin_y, field.shape[1], field.shape[0],
+                                   memoryview(numpy.ascontiguousarray(field)).cast("B").cast("b"))
+                        for color_id, (origin_x, origin_y, field) in fields.items()}
+
+    @classmethod
+    def build(cls, static_capsules, band=SDF_BAND):
+        by_color = {}
+        for capsule in static_capsules:
+            by_color.setdefault(capsule[5], []).append(capsule)
+        return cls({color_id: cls._build_field(capsules, band) for color_id, capsules in by_color.items()}, band)
+
+    @staticmethod
+    def _build_field(capsules, band):
+        reach = max(capsule[4] for capsule in capsules) + band + 1
+        origin_x = math.floor(min(min(capsule[0], capsule[2]) for capsule in capsules) - reach)
+        origin_y = math.floor(min(min(capsule[1], capsule[3]) for capsule in capsules) - reach)
+        width = math.ceil(max(max(capsule[0], capsule[2]) for capsule in capsules) + reach) - origin_x + 1
+        height = math.ceil(max(max(capsule[1], capsule[3]) for capsule in capsules) + reach) - origin_y + 1
+        field = numpy.full((height, width), band, dtype=numpy.int8)
+        for sx, sy, ex, ey, radius, _, _ in capsules:
+            # Every cell within band of this capsule's surface
+            x0 = math.floor(min(sx, ex) - radius - band) - origin_x
+            x1 = math.ceil(max(sx, ex) + radius + band) - origin_x + 1
+            y0 = math.floor(min(sy, ey) - radius - band) - origin_y
+            y1 = math.ceil(max(sy, ey) + radius + band) - origin_y + 1
+            px = numpy.arange(x0 + origin_x, x1 + origin_x, dtype=numpy.float64)[None, :]
+            py = numpy.arange(y0 + origin_y, y1 + origin_y, dtype=numpy.float64)[:, None]
+            dx = ex - sx
+            dy = ey - sy
+            length_sq = dx * dx + dy * dy
+            if length_sq == 0:
+                t = 0
+            else:
+                t = numpy.clip(((px - sx) * dx + (py - sy) * dy) / length_sq, 0, 1)
+            nx = sx + dx * t - px
+            ny = sy + dy * t - py
+            # Nudged down so rounding never lifts a cell above the true floor
+            distance = numpy.floor(numpy.sqrt(nx * nx + ny * ny) - radius - 1e-9)
+            window = field[y0:y1, x0:x1]
+            numpy.minimum(window, numpy.clip(distance, -band, band).astype(numpy.int8), out=window)
+        return origin_x, origin_y, field
+
+    def sample(self, color_id, x, y):
+        # (floor of the signed distance at the nearest integer point, how far
+        # that point is from (x, y)); the true distance at (x, y) lies within
+        # [floor - offset, floor + 1 + offset)
+        qx = round(x)
+        qy = round(y)
+        offset = math.hypot(x - qx, y - qy)
+        entry = self._lookup.get(color_id)
+        if entry is None:
+            return self.band, offset
+        origin_x, origin_y, width, height, cells = entry
+        ix = qx - origin_x
+        iy = qy - origin_y
+        if 0 <= iy < height and 0 <= ix < width:
+            return cells[iy * width + ix], offset
+        return self.band, offset
+
+    def clear_of(self, color_id, x, y, reach):
+        # True when no static stroke of color_id comes within reach of (x, y)
+        distance, offset = self.sample(color_id, x, y)
+        return distance - offset > reach + 1e-6
+
+    def inside(self, color_id, x, y):
+        # True when (x, y) is certainly covered by a static stroke of color_id
+        distance, offset = self.sample(color_id, x, y)
+        return distance + 1 + offset < -1e-6
+
+    def to_arrays(self):
+        arrays = {"band": numpy.array(self.band)}
+        for color_id, (origin_x, origin_y, field) in self.fields.items():
+            arrays[f"field{color_id}"] = field
+            arrays[f"origin{color_id}"] = numpy.array((origin_x, origin_y))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        fields = {}
+        for name in arrays.files:
+            if name.startswith("field"):
+                color_id = int(name[len("field"):])
+                origin_x, origin_y = (int(value) for value in arrays[f"origin{color_id}"])
+                fields[color_id] = (origin_x, origin_y, arrays[name])
+        return cls(fields, int(arrays["band"]))
+
+
+class DistanceFieldWorld(CapsuleWorld):
+    """
+    CapsuleWorld with a distance field over each level's static strokes.
+
+    Answers are the same as CapsuleWorld's, but the field settles most
+    queries in O(1). That makes it faster than CapsuleWorld, though still
+    slower than the raster grid (benchmark.py collision, landing). A hitbox whose center is farther than its
+    half-diagonal from every static stroke of a color cannot touch that
+    color's static geometry, and then only this frame's strokes (the
+    moving platforms of level 2) are tested, analytically. A hitbox whose
+    center lies inside a stroke touches it when nothing else is near.
+    Everything in between goes through the capsule tests. Landing
+    (hitbox_clearance) uses the signed distance the same way, to rise
+    through the depth of the ground without testing capsules.
+
+    A level's field is built the first time its static layer is set, and
+    with a cache directory it is also kept there across runs.
+    """
+
+    def __init__(self, cache_dir=None):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.distance_fields = {}  # id(static_capsules) -> (static_capsules, LevelDistanceField)
+        self.field = None
+        self.field_hits = 0
+        self.field_misses = 0
+
+    def clear(self):
+        super().clear()
+        self.field = None
+
+    def set_static_layer(self, static_index, static_capsules, offset_x, offset_y):
+        super().set_static_layer(static_index, static_capsules, offset_x, offset_y)
+        entry = self.distance_fields.get(id(static_capsules))
+        if entry is None:
+            # The capsule list is kept alongside so its id is never reused
+            entry = (static_capsules, self._load_field(static_capsules))
+            self.distance_fields[id(static_capsules)] = entry
+        self.field = entry[1]
+
+    def _field_path(self, static_capsules):
+        digest = hashlib.sha1(repr((SDF_CACHE_VERSION, SDF_BAND, static_capsules)).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"sdf-{digest}.npz")
+
+    def _load_field(self, static_capsules):
+        if not static_capsules:
+            return LevelDistanceField({}, SDF_BAND)
+        if self.cache_dir is not None:
+            path = self._field_path(static_capsules)
+            try:
+                with numpy.load(path) as arrays:
+                    return LevelDistanceField.from_arrays(arrays)
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                # Missing, truncated or from another version: build it afresh
+                pass
+        field = LevelDistanceField.build(static_capsules)
+        if self.cache_dir is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(path + ".tmp", "wb") as field_file:
+                    numpy.savez(field_file, **field.to_arrays())
+                os.replace(path + ".tmp", path)
+            except OSError as error:
+                print(f"WARN: Could not write the distance field cache: {error}")
+                self.cache_dir = None
+        return field
+
+    def hitbox_clearance(self, left, right, spans, color_id):
+        # Walks the rising hitbox on the field while it can: a span whose
+        # bottom centre lies inside a static stroke touches it, and the signed
+        # distance says how many more spans certainly do too; a span clear
+        # of every static stroke of color_id ends the rise. From the first
+        # span this frame's strokes reach (the character, the moving
+        # platforms of level 2) or the field cannot settle, the capsule
+        # tests take over
+        if color_id == COLOR_ID_AIR or self.field is None:
+            return super().hitbox_clearance(left, right, spans, color_id)
+        spans = iter(spans)
+        span = next(spans, None)
+        if span is None:
+            return 0
+        right -= 1
+        offset_x, offset_y = self.static_offset
+        center_x = (left + right) / 2 - offset_x
+        # Rows this frame's strokes may reach in the hitbox's column, from
+        # their bounding boxes; they only ever sit on the stage
+        dynamic = []
+        for item in self.index.query(left, span[0], right, COLOR_GRID_HEIGHT):
+            sx, sy, ex, ey, radius = self.capsules[item][:5]
+            dynamic.append((min(sy, ey) - radius, max(sy, ey) + radius))
+        count = 0
+        while span is not None:
+            top, bottom = span
+            bottom -= 1
+            if any(top <= highest and bottom >= lowest for lowest, highest in dynamic):
+                break
+            center_y = (top + bottom) / 2 - offset_y
+            # Spans can be a unit taller further up, hence the extra unit of reach
+            reach = math.hypot(right - left, bottom - top) / 2 + 1
+            # The bottom of a landing hitbox is the part deepest in the ground
+            distance, offset = self.field.sample(color_id, center_x, top - offset_y)
+            depth = -(distance + 1 + offset)
+            if depth <= 1e-6:
+                if self.field.clear_of(color_id, center_x, center_y, reach):
+                    self.field_hits += 1
+                    return count
+                break
+            # Each span is at most one unit above the last one: its bottom
+            # centre stays inside for depth units, and static strokes of other
+            # colors that are clear of the hitbox now stay so for margin units
+            margin = min((other_distance - other_offset - reach
+                          for other_distance, other_offset in
+                          (self.field.sample(other_id, center_x, center_y)
+                           for other_id in self.field.fields if other_id != color_id)),
+                         default=math.inf)
+            if margin <= 1e-6:
+                break
+            self.field_hits += 1
+            rise = 0
+            while True:
+                count += 1
+                rise += 1
+                span = next(spans, None)
+                if span is None or rise > depth or rise >= margin - 1e-6:
+                    break
+                top, bottom = span
+                if any(top <= highest and bottom - 1 >= lowest for lowest, highest in dynamic):
+                    break
+        if span is None:
+            return count
+        self.field_misses += 1
+        return count + super().hitbox_clearance(left, right + 1, itertools.chain((span,), spans), color_id)
+
+    def hitbox_touches(self, left, right, top, bottom, color_id):
+        if color_id == COLOR_ID_AIR or self.field is None:
+            return super().hitbox_touches(left, right, top, bottom, color_id)
+        right -= 1
+        bottom -= 1
+        offset_x, offset_y = self.static_offset
+        center_x = (left + right) / 2 - offset_x
+        center_y = (top + bottom) / 2 - offset_y
+        reach = math.hypot(right - left, bottom - top) / 2
+        dynamic = [self.capsules[item] for item in self.index.query(left, top, right, bottom)] if self.capsules else []
+        if self.field.clear_of(color_id, center_x, center_y, reach) \
+                and all(capsule[6] >= self.static_order_base for capsule in dynamic if capsule[5] == color_id):
+            # Static strokes of other colors sit below every match drawn
+            # after the level, so they can no longer change the answer
+            self.field_hits += 1
+            return bool(dynamic) and self._capsules_touch(dynamic, left, right, top, bottom, color_id)
+        if not dynamic and self.field.inside(color_id, center_x, center_y) \
+                and all(self.field.clear_of(other_id, center_x, center_y, reach)
+                        for other_id in self.field.fields if other_id != color_id):
+            self.field_hits += 1
+            return True
+        self.field_misses += 1
+        return self._capsules_touch(self.candidates(left, right, top, bottom), left, right, top, bottom, color_id)
+
+
+def _point_segment_distance_sq(px, py, sx, sy, ex, ey):
+    dx = ex - sx
+    dy = ey - sy
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        t = 0
+    else:
+        t = max(0, min(1, ((px - sx) * dx + (py - sy) * dy) / length_sq))
+    nx = sx + dx * t - px
+    ny = sy + dy * t - py
+    return nx * nx + ny * ny
+
+
+def _capsule_line_span(sx, sy, ex, ey, radius, line_y):
+    # (low, high) of the x where the capsule meets the line y = line_y, in
+    # closed form; None when it misses. Swap the axes for a vertical line
+    radius_sq = radius * radius
+    low = math.inf
+    high = -math.inf
+    for px, py in ((sx, sy), (ex, ey)):
+        reach_sq = radius_sq - (line_y - py) * (line_y - py)
+        if reach_sq >= 0:
+            reach = math.sqrt(reach_sq)
+            low = min(low, px - reach)
+            high = max(high, px + reach)
+    # The band around the segment's body: 0 <= (p - s).d <= |d|^2 and |(p - s) x d| <= r |d|
+    dx = ex - sx
+    dy = ey - sy
+    length_sq = dx * dx + dy * dy
+    if length_sq > 0:
+        band_low = -math.inf
+        band_high = math.inf
+        for coefficient, constant, lower, upper in (
+                (dx, (line_y - sy) * dy - sx * dx, 0, length_sq),
+                (dy, -(line_y - sy) * dx - sx * dy, -radius * math.sqrt(length_sq), radius * math.sqrt(length_sq))):
+            if coefficient == 0:
+                if not lower <= constant <= upper:
+                    band_low, band_high = math.inf, -math.inf
+                continue
+            bounds = ((lower - constant) / coefficient, (upper - constant) / coefficient)
+            band_low = max(band_low, min(bounds))
+            band_high = min(band_high, max(bounds))
+        if band_low <= band_high:
+            low = min(low, band_low)
+            high = max(high, band_high)
+    if low > high:
+        return None
+    return low, high
+
+
+def _capsule_row_cells(capsule, cell_y, left, right):
+    """
+    The cells of row cell_y in [left, right] a capsule covers, as (first,
+    last), by _point_segment_distance_sq's test; None when it covers none.
+    A capsule meets a line in one interval, found here in closed form and
+    then settled against the exact test at its ends.
+    """
+    sx, sy, ex, ey, radius = capsule[:5]
+    radius_sq = radius * radius
+    span = _capsule_line_span(sx, sy, ex, ey, radius, cell_y)
+    if span is None:
+        return None
+    first = max(left, math.ceil(span[0]))
+    last = min(right, math.floor(span[1]))
+
+    def covered(cell_x):
+        return _point_segment_distance_sq(cell_x, cell_y, sx, sy, ex, ey) <= radius_sq
+
+    # Rounding can leave either end one cell off
+    while first > left and covered(first - 1):
+        first -= 1
+    while first <= last and not covered(first):
+        first += 1
+    while last < right and covered(last + 1):
+        last += 1
+    while last >= first and not covered(last):
+        last -= 1
+    if first > last:
+        return None
+    return first, last
+
+
+def _capsule_rows(capsule, left, right, low, high):
+    """
+    The rows a capsule reaches over the columns [left, right], within rows
+    [low, high], as (lowest, highest): a rectangle [left, right] x [top,
+    bottom] inside [low, high] touches the capsule exactly when
+    top <= highest and bottom >= lowest, as _segment_rect_distance_sq would
+    find. None when the capsule misses [left, right] x [low, high].
+    """
+    sx, sy, ex, ey, radius = capsule[:5]
+    radius_sq = radius * radius
+    if _segment_rect_distance_sq(sx, sy, ex, ey, left, low, right, high) > radius_sq:
+        return None
+
+    def reaches_above(row):
+        return _segment_rect_distance_sq(sx, sy, ex, ey, left, row, right, high) <= radius_sq
+
+    def reaches_below(row):
+        return _segment_rect_distance_sq(sx, sy, ex, ey, left, low, right, row) <= radius_sq
+
+    # The capsule's top and bottom over the columns lie on the vertical line
+    # nearest its highest and lowest points; the closed-form answer is then
+    # settled against the exact test, as rounding can leave it a row off
+    if sy == ey:
+        top_x = bottom_x = min(max(left, min(sx, ex)), right)
+    else:
+        top_x = min(max(left, sx if sy > ey else ex), right)
+        bottom_x = min(max(left, sx if sy < ey else ex), right)
+    top_span = _capsule_line_span(sy, sx, ey, ex, radius, top_x)
+    bottom_span = _capsule_line_span(sy, sx, ey, ex, radius, bottom_x)
+    highest = min(high, max(low, math.floor(top_span[1]))) if top_span is not None else high
+    lowest = max(low, min(high, math.ceil(bottom_span[0]))) if bottom_span is not None else low
+    while highest < high and reaches_above(highest + 1):
+        highest += 1
+    while highest > low and not reaches_above(highest):
+        highest -= 1
+    while lowest > low and reaches_below(lowest - 1):
+        lowest -= 1
+    while lowest < high and not reaches_below(lowest):
+        lowest += 1
+    return lowest, highest
+
+
+def _segment_rect_distance_sq(sx, sy, ex, ey, left, top, right, bottom):
+    # Squared distance between segment (sx, sy)-(ex, ey) and the axis-aligned
+    # rectangle [left, right] x [top, bottom]; zero when they intersect.
+    # Liang-Barsky clip: does any part of the segment lie inside the rectangle?
+    t0, t1 = 0.0, 1.0
+    dx = ex - sx
+    dy = ey - sy
+    for p, q in ((-dx, sx - left), (dx, right - sx), (-dy, sy - top), (dy, bottom - sy)):
+        if p == 0:
+            if q < 0:
+                break
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                break
+    else:
+        return 0
+    # Disjoint: the closest pair involves an endpoint or a rectangle corner
+    best = float("inf")
+    for px, py in ((sx, sy), (ex, ey)):
+        cx = min(max(px, left), right) - px
+        cy = min(max(py, top), bottom) - py
+        best = min(best, cx * cx + cy * cy)
+    for cx, cy in ((left, top), (left, bottom), (right, top), (right, bottom)):
+        best = min(best, _point_segment_distance_sq(cx, cy, sx, sy, ex, ey))
+    return best
+
+
+color_grid = make_color_grid()
+capsule_world = CapsuleWorld()
+distance_field_world = None  # Created on first use; needs NumPy
+
+
+def make_collision_backend(backend=COLLISION_BACKEND):
+    # "raster" collides against color_grid, "analytic" against capsule_world,
+    # "sdf" against distance_field_world (falls back to "analytic" without NumPy)
+    global distance_field_world
+    if backend == "analytic":
+        return capsule_world
+    if backend == "sdf":
+        if numpy is None:
+            print("WARN: NumPy is not available, using the analytic collision backend.")
+            return capsule_world
+        if distance_field_world is None:
+            distance_field_world = DistanceFieldWorld(get_user_cache_dir() if SDF_CACHE_ON_DISK else None)
+        return distance_field_world
+    if backend != "raster":
+        print(f"WARN: Unknown collision backend '{backend}', using the raster grid.")
+    return color_grid
+
+
+collision_backend = make_collision_backend()
+
+
+def select_grid_engine(engine):
+    global color_grid, collision_backend
+    raster = collision_backend is color_grid
+    color_grid = make_color_grid(engine)
+    if raster:
+        collision_backend = color_grid
+
+
+def select_collision_backend(backend):
+    global collision_backend
+    collision_backend = make_collision_backend(backend)
+
+
+def _stroke_on_stage(start_x, start_y, end_x, end_y, pen_size):
+    """
+    Whether a stroke's capsule can reach the stage (and so the grid).
+    The reach is half the pen size plus one unit, which covers both the drawn
+    line and the grid's truncated disc centres just outside the stage edge.
+    """
+    half_width = COLOR_GRID_WIDTH / 2
+    half_height = COLOR_GRID_HEIGHT / 2
+    if -half_width <= start_x <= half_width and -half_height <= start_y <= half_height:
+        return True
+    reach = pen_size / 2 + 1
+    if (max(start_x, end_x) < -half_width - reach or min(start_x, end_x) > half_width + reach
+            or max(start_y, end_y) < -half_height - reach or min(start_y, end_y) > half_height + reach):
+        return False
+    distance_sq = _segment_rect_distance_sq(start_x, start_y, end_x, end_y,
+                                            -half_width, -half_height, half_width, half_height)
+    return distance_sq <= reach * reach
+
+
+def use_static_collision_layer(static_index, static_capsules, offset_x, offset_y):
+    """
+    Hands a level's static geometry to the collision backend as a prebuilt index.
+    Returns False when the backend needs those strokes written to it instead.
+    """
+    if isinstance(collision_backend, CapsuleWorld):
+        collision_backend.set_static_layer(static_index, static_capsules, offset_x, offset_y)
+        return True
+    return False
+
+
+def reset_color_grid():
+    collision_backend.clear()
 
 
 def _write_line_to_grid(start_pos, end_pos, thickness, color_id):
+    # Records a stroke with the active collision backend
     if color_id is None:
         return
-    sx, sy = start_pos
-    ex, ey = end_pos
-    dx = ex - sx
-    dy = ey - sy
-    steps = int(max(abs(dx), abs(dy), 1) * 2)
-    radius = max(0.5, thickness / 2)
-    for i in range(steps + 1):
-        t = i / steps
-        px = sx + dx * t
-        py = sy + dy * t
-        _write_disc_to_grid(px, py, radius, color_id)
+    collision_backend.write_line(start_pos, end_pos, thickness, color_id)
+
 
 ## ScratchPen class (used globally)
 # This is a reimplmentation of the Scratch pen in Pygame
@@ -119,6 +1210,26 @@ class ScratchPen:
         # Pen history for drawing
         self.last_pos = (self.x, self.y)  # Store the last position for line drawing
 
+        # Strokes drawn and culled off-stage since the last reset_frame_stats()
+        self.segments_drawn = 0
+        self.segments_culled = 0
+
+        # True until something is drawn after erase_all()
+        self.blank = True
+
+        # When a list, every stroke drawn is also appended to it as a segment
+        # tuple (see draw_segments), so it can be drawn again later
+        self.stroke_log = None
+
+        # touching_color results, valid while the collision backend stays at
+        # the generation they were computed for
+        self._touch_memo = {}
+        self._touch_backend = None
+        self._touch_generation = None
+        # touching_color calls and memo hits since the last reset_frame_stats()
+        self.touch_queries = 0
+        self.touch_hits = 0
+
     # Turn clockwise by n degrees
     def turn_right(self, n):
         self.direction += n
@@ -131,20 +1242,103 @@ class ScratchPen:
 
     # Move pen to new position
     def goto(self, x, y):
-        if self.pen_down_status:
+        if self.pen_down_status and not _stroke_on_stage(self.x, self.y, x, y, self.pen_size):
+            self.segments_culled += 1
+        elif self.pen_down_status:
+            self.segments_drawn += 1
+            self.blank = False
             start = (self.x, self.y)
             end = (x, y)
+            # scratch_to_pygame_coordinates, inlined
             draw_rounded_line(
                 self.surface,
                 self.pen_color,
-                scratch_to_pygame_coordinates(*start),
-                scratch_to_pygame_coordinates(*end),
+                (self.x * SCALE_FACTOR + RENDER_WIDTH // 2, RENDER_HEIGHT // 2 - self.y * SCALE_FACTOR),
+                (x * SCALE_FACTOR + RENDER_WIDTH // 2, RENDER_HEIGHT // 2 - y * SCALE_FACTOR),
                 self.pen_size,
             )
-            _write_line_to_grid(start, end, self.pen_size, _resolve_color_id(self.pen_color))
+            color_id = _resolve_color_id(self.pen_color)
+            _write_line_to_grid(start, end, self.pen_size, color_id)
+            if self.stroke_log is not None:
+                self.stroke_log.append((self.x, self.y, x, y, self.pen_size, self.pen_color, color_id))
         self.x, self.y = x, y  # Update native coordinates
         self.last_pos = (self.x, self.y)  # Update for the next movement
 
+    # Draw a connected stroke through points, as goto() on each point in turn
+    # would, but with every joint's cap drawn once and the grid written in
+    # one pass per run of on-stage segments
+    def polyline(self, points):
+        if self.pen_down_status:
+            color_id = _resolve_color_id(self.pen_color)
+            segments = []
+            x, y = self.x, self.y
+            for end_x, end_y in points:
+                segments.append((x, y, end_x, end_y, self.pen_size, self.pen_color, color_id))
+                x, y = end_x, end_y
+            self.draw_segments(segments)
+            if self.stroke_log is not None:
+                self.stroke_log.extend(segments)
+        if points:
+            self.x, self.y = points[-1]
+            self.last_pos = (self.x, self.y)
+
+    # Draw pre-recorded segments translated by (offset_x, offset_y)
+    # Segments are (start_x, start_y, end_x, end_y, pen_size, color, color_id)
+    # tuples, as produced by RecordingPen. Pen state is left untouched.
+    # With collide=False the strokes are drawn but not given to collision;
+    # with render=False they are given to collision but not drawn.
+    # Consecutive segments that join end to start in the same style are drawn
+    # as one polyline.
+    def draw_segments(self, segments, offset_x=0, offset_y=0, collide=True, render=True):
+        run = []
+        run_style = None
+        for start_x, start_y, end_x, end_y, size, color, color_id in segments:
+            start_x += offset_x
+            start_y += offset_y
+            end_x += offset_x
+            end_y += offset_y
+            if not _stroke_on_stage(start_x, start_y, end_x, end_y, size):
+                self.segments_culled += 1
+                continue
+            style = (size, color, color_id)
+            if run and (run[-1] != (start_x, start_y) or style != run_style):
+                self._draw_run(run, run_style, collide, render)
+                run = []
+            if not run:
+                run.append((start_x, start_y))
+                run_style = style
+            run.append((end_x, end_y))
+        if run:
+            self._draw_run(run, run_style, collide, render)
+
+    def _draw_run(self, points, style, collide, render):
+        size, color, color_id = style
+        if render:
+            self.segments_drawn += len(points) - 1
+            self.blank = False
+            draw_rounded_polyline(
+                self.surface,
+                color,
+                [(x * SCALE_FACTOR + RENDER_WIDTH // 2, RENDER_HEIGHT // 2 - y * SCALE_FACTOR) for x, y in points],
+                size,
+            )
+        if collide and color_id is not None:
+            collision_backend.write_polyline(points, size, color_id)
+
+    # Draw one letter at the pen, as draw_letter would, from the glyph atlas
+    def draw_glyph(self, letter, size):
+        if self.stroke_log is not None:
+            # Logged text must stay strokes; the atlas draws the same pixels
+            draw_letter(self, letter, size)
+            return
+        glyph_atlas.draw(self, letter, size)
+
+    def reset_frame_stats(self):
+        self.segments_drawn = 0
+        self.segments_culled = 0
+        self.touch_queries = 0
+        self.touch_hits = 0
+
     # Change x by n
     def change_x_by(self, n):
         self.goto(self.x + n, self.y)
@@ -187,6 +1381,7 @@ class ScratchPen:
     # Erase all
     def erase_all(self):
         self.surface.fill(BACKGROUND_COLOR)
+        self.blank = True
         reset_color_grid()
 
     # Adjust color brightness based on shade percentage
@@ -206,7 +1401,7 @@ class ScratchPen:
 
     # Check if pen is touching a specific color with a specified hitbox
     def touching_color(self, color, hitbox_dimensions):
-        color_id = _resolve_color_id(color)
+        color_id = _touching_color_id(color)
         if color_id is None:
             return False
 
@@ -216,15 +1411,55 @@ class ScratchPen:
         top = int(self.y - hitbox_height // 2)
         bottom = int(self.y + math.ceil(hitbox_height / 2))
 
-        for sx in range(left, right):
-            for sy in range(top, bottom):
-                gx, gy = scratch_to_grid(sx, sy)
-                if gx is None:
-                    continue
-                if color_grid[gy][gx] == color_id:
-                    return True
-        return False
+        self.touch_queries += 1
+        if not TOUCH_MEMO:
+            return collision_backend.hitbox_touches(left, right, top, bottom, color_id)
+        # Positions that truncate to the same cells ask the same question;
+        # any write to the backend (the character's own strokes included)
+        # starts a new generation and forgets the answers
+        if self._touch_backend is not collision_backend or self._touch_generation != collision_backend.generation:
+            self._touch_memo.clear()
+            self._touch_backend = collision_backend
+            self._touch_generation = collision_backend.generation
+        key = (left, right, top, bottom, color_id)
+        touching = self._touch_memo.get(key)
+        if touching is None:
+            touching = self._touch_memo[key] = collision_backend.hitbox_touches(left, right, top, bottom, color_id)
+        else:
+            self.touch_hits += 1
+        return touching
     
+    # Rise one unit at a time, as repeated change_y_by(1) would, while the
+    # hitbox touches color and the pen is at or below max_y. Every step's
+    # hitbox goes to the collision backend in one query. Returns the number
+    # of steps taken.
+    def rise_until_clear(self, color, hitbox_dimensions, max_y):
+        color_id = _resolve_color_id(color)
+        if color_id is None:
+            return 0
+
+        hitbox_width, hitbox_height = hitbox_dimensions
+        left = int(self.x - hitbox_width // 2)
+        right = int(self.x + math.ceil(hitbox_width / 2))
+
+        def spans():
+            # Same float steps and truncation as touching_color after each move
+            y = self.y
+            while y <= max_y:
+                yield int(y - hitbox_height // 2), int(y + math.ceil(hitbox_height / 2))
+                y += 1
+
+        steps = collision_backend.hitbox_clearance(left, right, spans(), color_id)
+        if self.pen_down_status:
+            for _ in range(steps):
+                self.change_y_by(1)
+        else:
+            y = self.y
+            for _ in range(steps):
+                y += 1
+            self.goto(self.x, y)
+        return steps
+
     # Move the pen n steps forward in the current direction
     def move(self, n):
         # Convert Scratch's direction system to standard trigonometric angles:
@@ -239,290 +1474,229 @@ class ScratchPen:
         # Move the pen to the new position
         self.goto(self.x + delta_x, self.y + delta_y)
 
+## RecordingPen class
+# A pen that records the strokes it would draw instead of drawing them.
+# Used to compile levels into display lists (see nrlevels.CompiledLevel).
+class RecordingPen(ScratchPen):
+    def __init__(self):
+        super().__init__(None)
+        self.segments = []
+
+    def goto(self, x, y):
+        if self.pen_down_status:
+            self.segments.append((self.x, self.y, x, y, self.pen_size, self.pen_color,
+                                  _resolve_color_id(self.pen_color)))
+        self.x, self.y = x, y
+        self.last_pos = (self.x, self.y)
+
+    def polyline(self, points):
+        for x, y in points:
+            self.goto(x, y)
+
+    def draw_glyph(self, letter, size):
+        # Recorded text must stay strokes
+        draw_letter(self, letter, size)
+
+    def erase_all(self):
+        self.segments.clear()
+
+
 ## Functions to draw text
+# Marks the end of '.': point up and step one unit, whatever the size
+_DOT = "dot"
+
+# Letter strokes at size 100, as (dx, dy, pen_down) moves from the top left
+# corner of the letter's cell. Letters are drawn with case-insensitive lookup,
+# as in Scratch; '/' is a space.
+LETTER_STROKES = {
+    'a': ((10, 0, True), (0, -30, True), (0, 15, True), (-10, 0, True), (0, -15, True),
+         (0, 30, True)),
+    'b': ((10, 0, True), (0, -13, True), (0, 13, True), (-10, 0, True), (0, -15, True),
+         (8, 0, True), (-8, 0, True), (0, -15, True), (10, 0, True), (0, 13, True)),
+    'c': ((10, 0, True), (-10, 0, True), (0, -30, True), (10, 0, True)),
+    'd': ((8, 0, True), (-8, 0, True), (0, -30, True), (10, 0, True), (0, 28, True)),
+    'e': ((10, 0, True), (-10, 0, True), (0, -15, True), (5, 0, True), (-5, 0, True),
+         (0, -15, True), (10, 0, True)),
+    'f': ((10, 0, True), (-10, 0, True), (0, -15, True), (5, 0, True), (-5, 0, True), (0, -15, True)),
+    'g': ((10, 0, True), (-10, 0, True), (0, -30, True), (10, 0, True), (0, 15, True), (-5, 0, True)),
+    'h': ((0, -30, True), (0, 15, True), (10, 0, True), (0, 15, True), (0, -30, True)),
+    'i': ((10, 0, True), (-5, 0, True), (0, -30, True), (-5, 0, True), (10, 0, True)),
+    'j': ((10, 0, True), (-5, 0, True), (0, -30, True), (-5, 0, True)),
+    'k': ((0, -30, True), (0, 15, True), (5, 0, True), (0, 10, True), (0, -10, True), (5, 0, True),
+         (0, -15, True)),
+    'l': ((0, -30, True), (10, 0, True)),
+    'm': ((0, -30, True), (0, 30, True), (5, 0, True), (0, -15, True), (0, 15, True), (5, 0, True),
+         (0, -30, True)),
+    'n': ((0, -30, True), (0, 30, True), (10, 0, True), (0, -30, True)),
+    'o': ((0, -30, True), (10, 0, True), (0, 30, True), (-10, 0, True)),
+    'p': ((0, -30, True), (0, 30, True), (10, 0, True), (0, -15, True), (-10, 0, True)),
+    'q': ((0, -25, True), (10, 0, True), (0, -5, True), (0, 30, True), (-10, 0, True)),
+    'r': ((10, 0, True), (0, -15, True), (-10, 0, True), (0, -15, True), (0, 30, True),
+         (0, -15, True), (8, 0, True), (0, -15, True)),
+    's': ((10, 0, True), (-10, 0, True), (0, -15, True), (10, 0, True), (0, -15, True),
+         (-10, 0, True)),
+    't': ((10, 0, True), (-5, 0, True), (0, -30, True)),
+    'u': ((0, -30, True), (10, 0, True), (0, 30, True)),
+    'v': ((0, -15, True), (2, 0, True), (0, -15, True), (6, 0, True), (0, 15, True), (2, 0, True),
+         (0, 15, True)),
+    'w': ((0, -30, True), (5, 0, True), (0, 15, True), (0, -15, True), (5, 0, True), (0, 30, True)),
+    'x': ((0, -10, True), (10, 0, True), (0, 10, True), (0, -10, True), (-5, 0, True),
+         (0, -10, True), (5, 0, True), (0, -10, True), (0, 10, True), (-10, 0, True), (0, -10, True)),
+    'y': ((0, -15, True), (10, 0, True), (0, 15, True), (0, -15, True), (-5, 0, True),
+         (0, -15, True)),
+    'z': ((10, 0, True), (0, -15, True), (-10, 0, True), (0, -15, True), (10, 0, True)),
+    '.': ((0, -30, False), _DOT),
+    '!': ((5, 0, False), (0, -20, True), (0, -10, False), (0, 1, True)),
+    '?': ((10, 0, True), (0, -15, True), (-5, 0, True), (0, -5, True), (0, -10, False), (0, 1, True)),
+    '"': ((0, -10, True), (0, 10, False), (10, 0, False), (0, -10, True)),
+    '0': ((0, -30, True), (10, 0, True), (0, 30, True), (-10, 0, True), (0, -15, False),
+         (5, 0, False), (0, 1, True)),
+    '1': ((5, 0, True), (0, -30, True), (5, 0, True), (-10, 0, True)),
+    '2': ((10, 0, True), (0, -10, True), (-10, 0, True), (0, -20, True), (10, 0, True)),
+    '3': ((10, 0, True), (0, -15, True), (-10, 0, True), (10, 0, True), (0, -15, True),
+         (-10, 0, True)),
+    '4': ((0, -15, True), (10, 0, True), (0, -15, True), (0, 30, True)),
+    '5': ((10, 0, True), (-10, 0, True), (0, -10, True), (10, 0, True), (0, -20, True),
+         (-10, 0, True)),
+    '6': ((0, -30, True), (10, 0, True), (0, 15, True), (-10, 0, True)),
+    '7': ((10, 0, True), (0, -30, True)),
+    '8': ((0, -30, True), (10, 0, True), (0, 30, True), (-10, 0, True), (0, -15, True),
+         (10, 0, True)),
+    '9': ((10, 0, True), (0, -30, True), (0, 15, True), (-10, 0, True), (0, 15, True)),
+    '-': ((0, -15, False), (10, 0, True)),
+}
+
+# Each letter's advance at size 100
+LETTER_ADVANCE = 15
+
+_scaled_letter_strokes = {}
+
+def _letter_strokes(size):
+    # LETTER_STROKES scaled to size, as (along_x, delta, pen_down) moves
+    strokes = _scaled_letter_strokes.get(size)
+    if strokes is None:
+        if len(_scaled_letter_strokes) >= 64:
+            _scaled_letter_strokes.clear()
+        strokes = {}
+        for letter, moves in LETTER_STROKES.items():
+            strokes[letter] = tuple(
+                _DOT if move is _DOT
+                else (move[1] == 0, (move[0] if move[1] == 0 else move[1]) * (size / 100), move[2])
+                for move in moves
+            )
+        _scaled_letter_strokes[size] = strokes
+    return strokes
+
 def draw_letter(pen, letter, size=100):
     if letter == '/':
         return
     letter = letter.lower() # Scratch uses case-insensitive letter comparison
-    if not(letter == '.' or letter == '!' or letter == '-'):
+    strokes = _letter_strokes(size).get(letter)
+    if strokes is None:
         pen.pen_down()
-    else:
+        print(f"WARN: Letter '{letter}' is not supported for drawing.")
         pen.pen_up()
+        return
 
-    # GitHub Copilot seems to know most of this letter-drawing code by itself
-    # Maybe someone ported this to Python before me...
-    if letter == 'a':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-    elif letter == 'b':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-13 * (size / 100))
-        pen.change_y_by(13 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(8 * (size / 100))
-        pen.change_x_by(-8 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(13 * (size / 100))
-    elif letter == 'c':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == 'd':
-        pen.change_x_by(8 * (size / 100))
-        pen.change_x_by(-8 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(28 * (size / 100))
-    elif letter == 'e':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == 'f':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-    elif letter == 'g':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-    elif letter == 'h':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-    elif letter == 'i':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == 'j':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-    elif letter == 'k':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(10 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-    elif letter == 'l':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == 'm':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-    elif letter == 'n':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-    elif letter == 'o':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == 'p':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == 'q':
-        pen.change_y_by(-25 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-5 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == 'r':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(8 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-    elif letter == 's':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == 't':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-    elif letter == 'u':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-    elif letter == 'v':
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(2 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(6 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(2 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-    elif letter == 'w':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-    elif letter == 'x':
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(10 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_y_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-    elif letter == 'y':
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-    elif letter == 'z':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == '.':
-        pen.change_y_by(-30 * (size / 100))
-        pen.pen_down()
-        pen.point_in_direction(0)
-        pen.move(1)
-    elif letter == '!':
-        pen.change_x_by(5 * (size / 100))
-        pen.pen_down()
-        pen.change_y_by(-20 * (size / 100))
-        pen.pen_up()
-        pen.change_y_by(-10 * (size / 100))
-        pen.pen_down()
-        pen.change_y_by(1 * (size / 100))
-    elif letter == '?':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-5 * (size / 100))
-        pen.change_y_by(-5 * (size / 100))
-        pen.pen_up()
-        pen.change_y_by(-10 * (size / 100))
-        pen.pen_down()
-        pen.change_y_by(1 * (size / 100))
-    elif letter == '"':
-        pen.change_y_by(-10 * (size / 100))
-        pen.pen_up()
-        pen.change_y_by(10 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.pen_down()
-        pen.change_y_by(-10 * (size / 100))
-    elif letter == '0':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
+    # Pen-down moves are gathered into one polyline; every point is computed
+    # as change_x_by or change_y_by would, from the one before it
+    run = []
+    x, y = pen.x, pen.y
+    for stroke in strokes:
+        if stroke is _DOT:
+            if run:
+                pen.pen_down()
+                pen.polyline(run)
+                run = []
+            pen.pen_down()
+            pen.point_in_direction(0)
+            pen.move(1)
+            x, y = pen.x, pen.y
+            continue
+        along_x, delta, down = stroke
+        if along_x:
+            x = x + delta
+        else:
+            y = y + delta
+        if down:
+            run.append((x, y))
+            continue
+        if run:
+            pen.pen_down()
+            pen.polyline(run)
+            run = []
         pen.pen_up()
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.pen_down()
-        pen.change_y_by(1 * (size / 100))
-    elif letter == '1':
-        pen.change_x_by(5 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(5 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == '2':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-20 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == '3':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == '4':
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-    elif letter == '5':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-10 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-20 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == '6':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-    elif letter == '7':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-    elif letter == '8':
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(30 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(-15 * (size / 100))
-        pen.change_x_by(10 * (size / 100))
-    elif letter == '9':
-        pen.change_x_by(10 * (size / 100))
-        pen.change_y_by(-30 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-        pen.change_x_by(-10 * (size / 100))
-        pen.change_y_by(15 * (size / 100))
-    elif letter == '-':
-        pen.change_y_by(-15 * (size / 100))
+        pen.goto(x, y)
+    if run:
         pen.pen_down()
-        pen.change_x_by(10 * (size / 100))
-    else:
-        print(f"WARN: Letter '{letter}' is not supported for drawing.")
+        pen.polyline(run)
     pen.pen_up()
-    # That's it for this super long function!
-    # I'm surprised GitHub Copilot knew EXACTLY what I was gonna write next!
+
+def letter_bounds(letter, size=100):
+    """
+    Box (left, bottom, right, top) around a letter's strokes, relative to
+    where it starts, or None when the letter draws nothing. Stroke width is
+    not included.
+    """
+    strokes = _letter_strokes(size).get(letter.lower())
+    if not strokes:
+        return None
+    x = y = 0
+    left = bottom = right = top = None
+    for stroke in strokes:
+        if stroke is _DOT:
+            # The dot steps a whole unit up, unscaled
+            points = ((x, y), (x, y + 1))
+        else:
+            along_x, delta, down = stroke
+            start = (x, y)
+            if along_x:
+                x += delta
+            else:
+                y += delta
+            if not down:
+                continue
+            points = (start, (x, y))
+        for point_x, point_y in points:
+            if left is None:
+                left = right = point_x
+                bottom = top = point_y
+            left = min(left, point_x)
+            right = max(right, point_x)
+            bottom = min(bottom, point_y)
+            top = max(top, point_y)
+    if left is None:
+        return None
+    return left, bottom, right, top
+
+def message_bounds(message, x, y, font_size):
+    """
+    Box (left, bottom, right, top) around everything load_message_at would
+    draw for message at (x, y), including the pen's width, or None when it
+    would draw nothing.
+    """
+    scale = font_size / 100
+    reach = 2.5 * scale / 2
+    bounds = None
+    for index, letter in enumerate(message):
+        box = letter_bounds(letter, font_size)
+        if box is None:
+            continue
+        origin_x = x + index * LETTER_ADVANCE * scale
+        box = (origin_x + box[0] - reach, y + box[1] - reach, origin_x + box[2] + reach, y + box[3] + reach)
+        if bounds is None:
+            bounds = box
+        else:
+            bounds = (min(bounds[0], box[0]), min(bounds[1], box[1]),
+                      max(bounds[2], box[2]), max(bounds[3], box[3]))
+    return bounds
+
+def measure_message(message, font_size):
+    """Width and height, in Scratch units, of message as load_message_at draws it."""
+    bounds = message_bounds(message, 0, 0, font_size)
+    if bounds is None:
+        return 0, 0
+    return bounds[2] - bounds[0], bounds[3] - bounds[1]
 
 
 # Function to draw a message at a specific location
@@ -544,8 +1718,158 @@ def load_message_at(pen, message, x, y, font_size, color):
         pen.set_pen_color_scratch(color)
     for doods in range(len(message)):
         pen.set_pen_size(2.5 * (size / 100))
-        draw_letter(pen, message[doods], font_size)
+        pen.draw_glyph(message[doods], font_size)
         pen.goto(x + ((doods + 1) * 15) * (size / 100), y)
     
     # Restore the previous pen status
-    pen.pen_down_status = prev_status
\ No newline at end of file
+    pen.pen_down_status = prev_status
+
+
+## GlyphAtlas class
+class GlyphAtlas:
+    """
+    LRU cache of pre-rendered letters, keyed by letter, size, pen size, color
+    and the pen's position modulo one Scratch unit.
+
+    A glyph is draw_letter recorded once: its strokes rendered to a small
+    colorkeyed surface, plus its collision footprint as grid row spans.
+    Drawing it again at a whole number of units away is a blit and a few
+    span fills, which land on exactly the pixels and cells the strokes
+    would. Letters that are not wholly on the stage are drawn stroke by
+    stroke instead.
+    """
+
+    def __init__(self, max_glyphs=GLYPH_ATLAS_SIZE):
+        self.max_glyphs = max_glyphs
+        self.glyphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _render(self, letter, size, pen_size, color, frac_x, frac_y):
+        recorder = RecordingPen()
+        recorder.x, recorder.y = frac_x, frac_y
+        recorder.pen_size = pen_size
+        recorder.pen_color = pygame.Color(color)
+        # None marks pen state the letter leaves as it was
+        recorder.pen_down_status = None
+        recorder.direction = None
+        draw_letter(recorder, letter, size)
+        end_state = (recorder.x - frac_x, recorder.y - frac_y, recorder.pen_down_status, recorder.direction)
+        segments = recorder.segments
+        if not segments:
+            return (None, 0, 0, [], segments, end_state)
+        # The footprint is taken on a stage-sized grid, so a glyph must fit
+        # well inside it around the origin; huge letters are never cached
+        if any(abs(segment[i]) > COLOR_GRID_WIDTH / 2 - 10 for segment in segments for i in (0, 2)) \
+                or any(abs(segment[i]) > COLOR_GRID_HEIGHT / 2 - 10 for segment in segments for i in (1, 3)):
+            return (None, 0, 0, [], segments, end_state)
+
+        # Pixel bounds of the strokes, with room for their round caps
+        reach = round(pen_size * SCALE_FACTOR) // 2 + 2
+        xs = [x * SCALE_FACTOR for segment in segments for x in (segment[0], segment[2])]
+        ys = [-y * SCALE_FACTOR for segment in segments for y in (segment[1], segment[3])]
+        left = math.floor(min(xs)) - reach + RENDER_WIDTH // 2
+        top = math.floor(min(ys)) - reach + RENDER_HEIGHT // 2
+        width = math.ceil(max(xs)) + reach + RENDER_WIDTH // 2 - left
+        height = math.ceil(max(ys)) + reach + RENDER_HEIGHT // 2 - top
+        surface = pygame.Surface((width, height))
+        key_color = (recorder.pen_color.r ^ 0xFF, recorder.pen_color.g, recorder.pen_color.b)
+        surface.fill(key_color)
+        surface.set_colorkey(key_color)
+        for start_x, start_y, end_x, end_y, stroke_size, stroke_color, _ in segments:
+            start = scratch_to_pygame_coordinates(start_x, start_y)
+            end = scratch_to_pygame_coordinates(end_x, end_y)
+            draw_rounded_line(
+                surface,
+                stroke_color,
+                (start[0] - left, start[1] - top),
+                (end[0] - left, end[1] - top),
+                stroke_size,
+            )
+
+        # Grid cells the strokes cover, as (row, start, end) spans
+        footprint_grid = ColorGrid()
+        for start_x, start_y, end_x, end_y, stroke_size, _, _ in segments:
+            footprint_grid.write_line((start_x, start_y), (end_x, end_y), stroke_size, COLOR_ID_LEVEL)
+        footprint = []
+        cells = footprint_grid.cells
+        for gy in range(footprint_grid.height):
+            row = cells[gy * footprint_grid.width:(gy + 1) * footprint_grid.width]
+            gx_end = 0
+            while True:
+                gx_start = row.find(COLOR_ID_LEVEL, gx_end)
+                if gx_start == -1:
+                    break
+                gx_end = row.find(COLOR_ID_AIR, gx_start)
+                if gx_end == -1:
+                    gx_end = footprint_grid.width
+                footprint.append((gy, gx_start, gx_end))
+        return (surface, left, top, footprint, segments, end_state)
+
+    def get(self, letter, size, pen_size, color, frac_x, frac_y):
+        key = (letter, size, pen_size, color, frac_x, frac_y)
+        glyph = self.glyphs.get(key)
+        if glyph is not None:
+            self.hits += 1
+            self.glyphs.move_to_end(key)
+            return glyph
+        self.misses += 1
+        glyph = self._render(letter, size, pen_size, color, frac_x, frac_y)
+        self.glyphs[key] = glyph
+        if len(self.glyphs) > self.max_glyphs:
+            self.glyphs.popitem(last=False)
+            self.evictions += 1
+        return glyph
+
+    def draw(self, pen, letter, size):
+        # Letters wholly off the stage are not worth a glyph; their strokes
+        # are all culled
+        box = letter_bounds(letter, size)
+        if box is not None:
+            reach = pen.pen_size / 2 + 1
+            if pen.x + box[2] + reach < -RENDER_WIDTH / (2 * SCALE_FACTOR) \
+                    or pen.x + box[0] - reach > RENDER_WIDTH / (2 * SCALE_FACTOR) \
+                    or pen.y + box[3] + reach < -RENDER_HEIGHT / (2 * SCALE_FACTOR) \
+                    or pen.y + box[1] - reach > RENDER_HEIGHT / (2 * SCALE_FACTOR):
+                draw_letter(pen, letter, size)
+                return
+        shift_x = math.floor(pen.x)
+        shift_y = math.floor(pen.y)
+        surface, left, top, footprint, segments, end_state = self.get(
+            letter.lower(), size, pen.pen_size, tuple(pen.pen_color), pen.x - shift_x, pen.y - shift_y)
+        if surface is None and segments:
+            draw_letter(pen, letter, size)
+            return
+        if surface is not None:
+            left += shift_x * SCALE_FACTOR
+            top -= shift_y * SCALE_FACTOR
+            # Off the stage, even in part, the strokes are culled and clipped
+            # one by one; keep a unit of margin so that cells never straddle
+            # the grid's edge either
+            if left < SCALE_FACTOR or top < SCALE_FACTOR \
+                    or left + surface.get_width() > RENDER_WIDTH - SCALE_FACTOR \
+                    or top + surface.get_height() > RENDER_HEIGHT - SCALE_FACTOR:
+                draw_letter(pen, letter, size)
+                return
+            pen.surface.blit(surface, (left, top))
+            pen.segments_drawn += len(segments)
+            pen.blank = False
+            color_id = _resolve_color_id(pen.pen_color)
+            if isinstance(collision_backend, ColorGrid):
+                for gy, gx_start, gx_end in footprint:
+                    collision_backend.fill_span(gy - shift_y, gx_start + shift_x, gx_end + shift_x, color_id)
+            else:
+                for start_x, start_y, end_x, end_y, stroke_size, _, _ in segments:
+                    collision_backend.write_line((start_x + shift_x, start_y + shift_y),
+                                                 (end_x + shift_x, end_y + shift_y), stroke_size, color_id)
+        end_x, end_y, pen_down_status, direction = end_state
+        pen.x, pen.y = pen.x + end_x, pen.y + end_y
+        pen.last_pos = (pen.x, pen.y)
+        if pen_down_status is not None:
+            pen.pen_down_status = pen_down_status
+        if direction is not None:
+            pen.direction = direction
+
+
+glyph_atlas = GlyphAtlas()